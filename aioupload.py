@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# asyncio upload engine (Python 3.7+), picked with engine = asyncio in
+# config.ini. One event loop drives every gsutil process through
+# asyncio.create_subprocess_exec, so thousands of small transfers in flight
+# cost a pipe each instead of a blocked thread each. Transfers the loop
+# cannot do by itself (client/local backends, resumable, composite and
+# gzipped files, rate limited runs) go to a thread pool of the same size.
+
+import os
+import sys
+import queue
+import tempfile
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import uploader
+
+# seconds between callback calls while nothing finishes, so a Tk progress
+# callback keeps the window responding during long transfers
+TICK = 0.05
+
+
+async def runCommand(command, data=None):
+    # (returncode, output) of command, with data written to its stdin
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except OSError as error:
+        return None, str(error)
+    output = await process.communicate(data)
+    return process.returncode, output[0]
+
+async def gsutilUpload(transport, path, name):
+    returncode, output = await runCommand([uploader.GSUTIL, "cp", path, "%s/%s" % (transport.destination, name)])
+    if returncode != 0:
+        print(output)
+        return "NG"
+    return "OK"
+
+async def gsutilBatch(transport, items):
+    # same as Gsutil_Transport.uploadBatch: one "gsutil -m cp -I" per
+    # destination folder, here all of them at once, and renamed files alone
+    folders = {}
+    renamed = []
+    for path, name in items:
+        if os.path.basename(name) != os.path.basename(path):
+            renamed.append((path, name))
+        else:
+            folders.setdefault(os.path.dirname(name), []).append(path)
+
+    async def copyFolder(paths, destination):
+        fd, logPath = tempfile.mkstemp(prefix="gsutil_", suffix=".csv")
+        os.close(fd)
+        try:
+            manifest = ("\n".join(paths) + "\n").encode('utf-8')
+            returncode, output = await runCommand([uploader.GSUTIL, "-m", "cp", "-I", "-L", logPath, destination],
+                                                  manifest)
+            if returncode is None:
+                print(output)
+                return {}
+            if returncode != 0:
+                print("gsutil cp -I to %s exited with %d:" % (destination, returncode))
+                print(output.decode('utf-8', 'replace').rstrip())
+            return uploader.Gsutil_Transport._parseLog(logPath)
+        finally:
+            os.remove(logPath)
+
+    async def copyOne(path, name):
+        return {path: await gsutilUpload(transport, path, name)}
+
+    outcome = {}
+    for part in await asyncio.gather(*([copyFolder(paths, "%s/%s/" % (transport.destination, folder))
+                                        for folder, paths in folders.items()] +
+                                       [copyOne(path, name) for path, name in renamed])):
+        outcome.update(part)
+    return ["OK" if outcome.get(path) == "OK" else "NG" for path, name in items]
+
+def _onLoop(transport, items, compress=False, sizes=None):
+    # plain copies with gsutil and nothing to throttle
+    if not isinstance(transport, uploader.Gsutil_Transport):
+        return False
+    limiter = transport.limiter
+    if limiter is not None and limiter.limits() != (0, 0):
+        return False
+    for k, (path, name) in enumerate(items):
+        if uploader._isLarge(transport, path, sizes[k] if sizes is not None else None):
+            return False
+    return not compress
+
+async def runGroup(transport, items, executor, compress=False, sizes=None):
+    # async counterpart of uploader._runGroup; never raises
+    try:
+        if not _onLoop(transport, items, compress, sizes):
+            return await asyncio.get_running_loop().run_in_executor(executor, uploader._runGroup, transport, items,
+                                                                    None, compress, sizes)
+        if len(items) == 1:
+            chunk = [await gsutilUpload(transport, *items[0])]
+        else:
+            chunk = await gsutilBatch(transport, items)
+        if transport.limiter is not None:
+            # for the throughput figure only, nothing is capped here
+            transport.limiter.request(len(items))
+            transport.limiter.transfer(sum(sizes) if sizes is not None else
+                                       sum(uploader._fileSize(path) for path, name in items))
+        return chunk
+    except Exception as error:
+        print(error)
+        return ["NG"] * len(items)
+
+async def uploadFilesAsync(listOfFiles, transport, dirName, workers=uploader.UPLOAD_WORKERS, callback=None,
+                           batchSize=uploader.UPLOAD_BATCH_SIZE, strategy=uploader.SCHEDULE_STRATEGY,
+                           retries=uploader.UPLOAD_RETRIES, controller=None, sizes=None):
+    # same contract as uploader.uploadFiles: results in listOfFiles order,
+    # failed files retried with backoff, callback(done) on the loop thread
+    results = [None] * len(listOfFiles)
+    if not listOfFiles:
+        return results
+
+    poolSize = controller.maximum if controller is not None else workers
+    executor = ThreadPoolExecutor(max_workers=max(1, poolSize))
+
+    def plan(sizes):
+        # stats and compression samples; off the loop, which other runs share
+        items = [(elem, transport.objectName(dirName, elem)) for elem in listOfFiles]
+        if sizes is None:
+            sizes = [uploader._fileSize(elem) for elem in listOfFiles]
+        return (items, sizes) + uploader._planGroups(items, sizes, transport, batchSize, strategy)
+
+    try:
+        items, sizes, groups, compressed = await asyncio.get_running_loop().run_in_executor(executor, plan, sizes)
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+
+    attempts = [0] * len(items)
+    done = [0]
+    # asyncio.Semaphore wakes waiters in order, so groups start in plan order
+    semaphore = asyncio.Semaphore(max(1, poolSize))
+    released = asyncio.Event()
+
+    async def run(group):
+        while True:
+            for i in group:
+                attempts[i] += 1
+            async with semaphore:
+                if controller is not None:
+                    while not controller.tryAcquire():
+                        released.clear()
+                        # the controller may be shared with other runs (the
+                        # waves of a pipeline), whose releases never set this
+                        try:
+                            await asyncio.wait_for(released.wait(), TICK)
+                        except asyncio.TimeoutError:
+                            pass
+                start = asyncio.get_running_loop().time()
+                chunk = await runGroup(transport, [items[i] for i in group], executor, group[0] in compressed,
+                                       [sizes[i] for i in group])
+                if controller is not None:
+                    controller.release("NG" not in chunk, asyncio.get_running_loop().time() - start, len(group),
+                                       sum(sizes[i] for i in group))
+                    released.set()
+
+            failed = []
+            for i, result in zip(group, chunk):
+                if result == "NG" and attempts[i] <= retries:
+                    failed.append(i)
+                else:
+                    results[i] = result
+                    done[0] += 1
+            if callback is not None:
+                callback(done[0])
+            if not failed:
+                return
+            group = failed
+            await asyncio.sleep(uploader.retryDelay(max(attempts[i] for i in group)))
+
+    async def tick():
+        while True:
+            await asyncio.sleep(TICK)
+            callback(done[0])
+
+    ticker = asyncio.ensure_future(tick()) if callback is not None else None
+    try:
+        await asyncio.gather(*[run(group) for group in groups])
+    finally:
+        if ticker is not None:
+            ticker.cancel()
+        executor.shutdown(wait=True)
+
+    for (path, name), count in zip(items, attempts):
+        transport.stats.setdefault(path, {})["attempts"] = count
+
+    return results
+
+# the engine loop and its thread, see _engineLoop()
+_engine = []
+_engineLock = threading.Lock()
+
+def _watchChildrenWithPidfd(loop):
+    # before 3.12 asyncio waits for every child process on a thread of its
+    # own, which is what this engine is meant to avoid; pidfds (Linux 5.3+)
+    # let the event loop wait for them itself. 3.12 does this by default.
+    # The watcher is process wide and serves one loop, the engine loop
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+def _engineLoop():
+    # the one event loop every run goes through, on a daemon thread of its
+    # own and started on first use. The pipeline and watch mode call the
+    # engine from worker threads, several at once; sharing one loop lets
+    # every gsutil process be waited for with a pidfd instead of a thread
+    with _engineLock:
+        if not _engine:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                if sys.platform != "win32":
+                    _watchChildrenWithPidfd(loop)
+                ready.set()
+                loop.run_forever()
+
+            thread = threading.Thread(target=run, name="aioupload-loop")
+            thread.daemon = True
+            thread.start()
+            ready.wait()
+            _engine.append(loop)
+        return _engine[0]
+
+def uploadFiles(listOfFiles, transport, dirName, workers=uploader.UPLOAD_WORKERS, callback=None, *args, **kwargs):
+    # blocking entry point with the signature of uploader.uploadFiles. The
+    # run goes to the engine loop; callback is called on this thread, at
+    # least every TICK, so it may still touch Tk
+    if callback is None:
+        return asyncio.run_coroutine_threadsafe(
+            uploadFilesAsync(listOfFiles, transport, dirName, workers, None, *args, **kwargs), _engineLoop()).result()
+
+    progress = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        uploadFilesAsync(listOfFiles, transport, dirName, workers, progress.put, *args, **kwargs), _engineLoop())
+    done = 0
+    try:
+        while True:
+            try:
+                future.result(TICK)
+                finished = True
+            except FutureTimeoutError:
+                finished = False
+            while not progress.empty():
+                done = progress.get()
+            callback(done)
+            if finished:
+                return future.result()
+    except BaseException:
+        future.cancel()
+        raise
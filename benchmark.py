@@ -0,0 +1,817 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks for the upload pipeline in uploader.py
+# usage: python benchmark.py <name> [options]
+#        python benchmark.py workers --files 200 --startup 0.05
+
+import os
+import io
+import sys
+import stat
+import time
+import shutil
+import heapq
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import statistics
+import subprocess
+import contextlib
+
+import moji
+import uploader
+
+
+# stand-in for gsutil: pays a fixed startup cost, then copies the files.
+# Understands "cp SRC DEST" and "-m cp -I -L LOG DEST" (names on stdin).
+FAKE_GSUTIL = '''#!%(python)s
+import os, sys, csv, time, shutil
+time.sleep(float(os.environ.get("FAKE_GSUTIL_STARTUP", "0.05")))
+argv = sys.argv[1:]
+log = argv[argv.index("-L") + 1] if "-L" in argv else None
+args = [a for a in argv if not a.startswith("-") and a not in ("cp", log)]
+dest = args[-1]
+if "-I" in argv:
+    sources = [line.strip() for line in sys.stdin if line.strip()]
+else:
+    sources = args[:-1]
+rows = []
+for src in sources:
+    target = os.path.join(dest, os.path.basename(src)) if "-I" in argv else dest
+    try:
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy(src, target)
+        result, description = "OK", ""
+    except (IOError, OSError) as error:
+        result, description = "error", str(error)
+    rows.append(["file://" + src, dest, "", "", "", "", "", "", result, description])
+if log:
+    with open(log, "a") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Source", "Destination", "Start", "End", "Md5", "UploadId",
+                         "Source Size", "Bytes Transferred", "Result", "Description"])
+        writer.writerows(rows)
+if any(row[8] != "OK" for row in rows):
+    sys.exit(1)
+'''
+
+
+def makeTree(root, files, size=1024):
+    # flat-ish synthetic tree of small files
+    for i in range(files):
+        folder = os.path.join(root, "d%03d" % (i // 100))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, "f%06d.dat" % i), "wb") as f:
+            f.write(os.urandom(size))
+
+
+def installFakeGsutil(workdir, startup):
+    path = os.path.join(workdir, "gsutil")
+    with open(path, "w") as f:
+        f.write(FAKE_GSUTIL % {"python": sys.executable})
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["FAKE_GSUTIL_STARTUP"] = str(startup)
+    uploader.GSUTIL = path
+
+
+@contextlib.contextmanager
+def quiet():
+    # the transports print gsutil output and errors, compositeUpload every slice
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_workers(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeTree(src, args.files)
+        installFakeGsutil(workdir, args.startup)
+        listOfFiles = uploader.getListOfFiles(src)
+
+        print("%8s %10s %12s" % ("workers", "seconds", "files/sec"))
+        for workers in args.workers:
+            transport = uploader.Gsutil_Transport(os.path.join(workdir, "dest%d" % workers), workers)
+
+            start = time.time()
+            with quiet():
+                uploader.uploadFiles(listOfFiles, transport, src, workers, batchSize=1)
+            elapsed = time.time() - start
+
+            print("%8d %10.2f %12.1f" % (workers, elapsed, len(listOfFiles) / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_batch(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeTree(src, args.files)
+        installFakeGsutil(workdir, args.startup)
+        listOfFiles = uploader.getListOfFiles(src)
+
+        print("%8s %8s %10s %12s" % ("batch", "workers", "seconds", "files/sec"))
+        for batchSize in args.batch:
+            transport = uploader.Gsutil_Transport(os.path.join(workdir, "dest%d" % batchSize), args.workers)
+
+            start = time.time()
+            with quiet():
+                results = uploader.uploadFiles(listOfFiles, transport, src, args.workers, batchSize=batchSize)
+            elapsed = time.time() - start
+            assert len(results) == len(listOfFiles)
+
+            print("%8d %8d %10.2f %12.1f" % (batchSize, args.workers, elapsed, len(listOfFiles) / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_backends(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeTree(src, args.files, args.size)
+        installFakeGsutil(workdir, args.startup)
+        listOfFiles = uploader.getListOfFiles(src)
+
+        runs = [
+            ("gsutil", uploader.Gsutil_Transport, 1),
+            ("gsutil -I", uploader.Gsutil_Transport, uploader.UPLOAD_BATCH_SIZE),
+            ("local", uploader.Local_Transport, 1),
+        ]
+
+        print("%10s %10s %12s" % ("backend", "seconds", "files/sec"))
+        for label, backend, batchSize in runs:
+            transport = backend(os.path.join(workdir, "dest-" + label.replace(" ", "")), args.workers)
+
+            start = time.time()
+            with quiet():
+                results = uploader.uploadFiles(listOfFiles, transport, src, args.workers, batchSize=batchSize)
+            elapsed = time.time() - start
+            assert results.count("OK") == len(listOfFiles)
+
+            print("%10s %10.2f %12.1f" % (label, elapsed, len(listOfFiles) / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_hash(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeTree(src, args.files, args.size)
+        listOfFiles = uploader.getListOfFiles(src)
+        algorithms = tuple(args.algorithms)
+        megabytes = args.files * args.size / 1048576.0
+
+        print("%-22s %10s %10s" % ("run", "seconds", "MB/sec"))
+        for workers in args.workers:
+            start = time.time()
+            uploader.hashFiles(listOfFiles, None, workers, algorithms)
+            elapsed = time.time() - start
+            print("%-22s %10.2f %10.1f" % ("cold, %d workers" % workers, elapsed, megabytes / elapsed))
+
+        cache = uploader.Hash_Cache(os.path.join(workdir, "hashes.db"))
+        uploader.hashFiles(listOfFiles, cache, max(args.workers), algorithms)
+        start = time.time()
+        uploader.hashFiles(listOfFiles, cache, max(args.workers), algorithms)
+        elapsed = time.time() - start
+        print("%-22s %10.2f %10.1f" % ("warm cache", elapsed, megabytes / elapsed))
+        cache.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_composite(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        os.makedirs(src)
+        path = os.path.join(src, "big.dat")
+        with open(path, "wb") as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+
+        print("%10s %10s %10s" % ("max slices", "seconds", "MB/sec"))
+        for slices in args.slices:
+            transport = uploader.Local_Transport(os.path.join(workdir, "dest%d" % slices), args.workers)
+            transport.checkpointDir = os.path.join(workdir, "checkpoints")
+            transport.compositeSlices = slices
+            # one slice means a plain single stream copy
+            transport.compositeThreshold = 1 if slices > 1 else float("inf")
+
+            start = time.time()
+            with quiet():
+                result = uploader.uploadOne(transport, path, "big.dat")
+            elapsed = time.time() - start
+            assert result == "OK"
+
+            print("%10d %10.2f %10.1f" % (slices, elapsed, args.size / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_client(args):
+    # runs every stream path of Client_Transport against a real bucket, or
+    # an emulator named by STORAGE_EMULATOR_HOST, and reads each object back
+    import gzip
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    transport = uploader.Client_Transport(args.destination.rstrip("/") + "/gcp_bench_%d" % os.getpid(), args.workers)
+    names = []
+    try:
+        path = os.path.join(workdir, "big.txt")
+        with open(path, "wb") as f:
+            # hex compresses to about half, still more than one upload chunk
+            for _ in range(args.size):
+                f.write(os.urandom(512 * 1024).hex().encode("ascii"))
+        with open(path, "rb") as f:
+            original = f.read()
+        megabytes = len(original) / 1048576.0
+
+        def composite(transport, path, name):
+            transport.checkpointDir = os.path.join(workdir, "checkpoints")
+            transport.compositeThreshold = 1
+            try:
+                return uploader.compositeUpload(transport, path, name)
+            finally:
+                transport.compositeThreshold = uploader.COMPOSITE_THRESHOLD
+
+        def throttled(transport, path, name):
+            # a cap far above the link speed: the path, not the wait, is timed
+            transport.limiter = uploader.Rate_Limiter(uploader.parseSchedule("00:00-00:00 10G 0"))
+            try:
+                return uploader.throttledUpload(transport, path, name)
+            finally:
+                transport.limiter = None
+
+        runs = [
+            ("upload", lambda transport, path, name: transport.upload(path, name)),
+            ("gzip", uploader.compressedUpload),
+            ("throttled", throttled),
+            ("composite", composite),
+        ]
+
+        print("%-10s %10s %10s %8s  %s" % ("path", "seconds", "MB/sec", "intact", "content type"))
+        for label, upload in runs:
+            name = "%s.txt" % label
+            names.append(name)
+            start = time.time()
+            with quiet():
+                result = upload(transport, path, name)
+            elapsed = time.time() - start
+            intact = False
+            storedType = "-"
+            if result == "OK":
+                blob = transport.bucket.get_blob(transport._blobName(name))
+                stored = blob.download_as_bytes(raw_download=True)
+                intact = (gzip.decompress(stored) if label == "gzip" else stored) == original
+                storedType = blob.content_type
+            print("%-10s %10.2f %10.1f %8s  %s" % (label, elapsed, megabytes / elapsed, "yes" if intact else "NO",
+                                                   storedType))
+    finally:
+        try:
+            transport.delete(transport.exists(names))
+        except Exception as error:
+            print(error)
+        transport.close()
+        shutil.rmtree(workdir)
+
+
+def simulateMakespan(durations, order, workers):
+    # each job starts on the first worker to become free, in the given order
+    free = [0.0] * workers
+    for i in order:
+        heapq.heappush(free, heapq.heappop(free) + durations[i])
+    return max(free)
+
+
+def syntheticSizes(kind, files, rng):
+    if kind == "uniform":
+        return [rng.randint(1, 10) * 1024 * 1024 for _ in range(files)]
+    if kind == "heavy-tail":
+        return [int(rng.lognormvariate(12, 2.5)) for _ in range(files)]
+    if kind == "giant-last":
+        # os.listdir order happily puts the one huge file at the end
+        return [rng.randint(1, 1024) * 1024 for _ in range(files - 1)] + [10 * 1024 ** 3]
+    raise ValueError(kind)
+
+
+def bench_schedule(args):
+    rng = random.Random(args.seed)
+    bandwidth = args.bandwidth * 1024 * 1024
+
+    print("%-12s %-12s %12s %12s" % ("tree", "strategy", "makespan s", "vs bound"))
+    for kind in ("uniform", "heavy-tail", "giant-last"):
+        sizes = syntheticSizes(kind, args.files, rng)
+        durations = [args.overhead + size / float(bandwidth) for size in sizes]
+        bound = max(sum(durations) / args.workers, max(durations))
+        for strategy in uploader.SCHEDULE_STRATEGIES:
+            makespan = simulateMakespan(durations, uploader.scheduleOrder(sizes, strategy), args.workers)
+            print("%-12s %-12s %12.1f %11.2fx" % (kind, strategy, makespan, makespan / bound))
+
+
+def bench_engines(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeTree(src, args.files)
+        installFakeGsutil(workdir, args.startup)
+        listOfFiles = uploader.getListOfFiles(src)
+
+        # direct uploadFiles() calls from the main thread, and uploadPipeline()
+        # runs as the CLI, the GUI and watch mode make them (from worker threads)
+        runs = [("serial", "threads", 1, "direct")]
+        for workers in args.workers:
+            for via in ("direct", "pipeline"):
+                runs.append(("threads", "threads", workers, via))
+                runs.append(("asyncio", "asyncio", workers, via))
+
+        print("%-8s %8s %8s %10s %12s %12s" % ("engine", "workers", "via", "seconds", "files/sec", "peak threads"))
+        for label, engine, workers, via in runs:
+            transport = uploader.Gsutil_Transport(os.path.join(workdir, "dest-%s%d%s" % (label, workers, via)), workers)
+            config = dict(uploader.DEFAULT_CONFIG, engine=engine, workers=workers, batch_size=1, incremental=False,
+                          adaptive=False, pack=False, dedup=False, compress=False, exclude="")
+
+            # sample the thread count while the run is going
+            peak = [threading.active_count()]
+            finished = threading.Event()
+
+            def sample():
+                while not finished.wait(0.01):
+                    peak[0] = max(peak[0], threading.active_count())
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+
+            start = time.time()
+            try:
+                with quiet():
+                    if via == "pipeline":
+                        ok = uploader.uploadPipeline(src, config, transport)["OK"]
+                    else:
+                        ok = uploader.uploadFiles(listOfFiles, transport, src, workers, batchSize=1,
+                                                  engine=engine).count("OK")
+            finally:
+                finished.set()
+                sampler.join()
+            elapsed = time.time() - start
+            assert ok == len(listOfFiles)
+
+            # minus the main and sampler threads
+            print("%-8s %8d %8s %10.2f %12.1f %12d" % (label, workers, via, elapsed, len(listOfFiles) / elapsed,
+                                                       peak[0] - 2))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def legacyListOfFiles(dirName):
+    # getListOfFiles as it was before walkFiles(), for comparison
+    listOfFile = os.listdir(dirName)
+    allFiles = list()
+    for entry in listOfFile:
+        fullPath = os.path.join(dirName, entry).replace('\\', '/')
+        if os.path.isdir(fullPath):
+            allFiles = allFiles + legacyListOfFiles(fullPath)
+        else:
+            allFiles.append(fullPath)
+    return allFiles
+
+
+def makeDeepTree(root, depth, width, files):
+    # width subfolders per level down to depth, files in every folder
+    folders = [root]
+    for level in range(depth + 1):
+        nextFolders = []
+        for folder in folders:
+            os.makedirs(folder)
+            for i in range(files):
+                open(os.path.join(folder, "f%03d" % i), "wb").close()
+            if level < depth:
+                nextFolders.extend(os.path.join(folder, "d%d" % i) for i in range(width))
+        folders = nextFolders
+
+
+def bench_walk(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeDeepTree(src, args.depth, args.width, args.files)
+
+        def streamed(dirName):
+            count = 0
+            for entry in uploader.walkFiles(dirName):
+                count += 1
+            return count
+
+        runs = [
+            ("listdir+isdir", lambda: len(legacyListOfFiles(src))),
+            ("getListOfFiles", lambda: len(uploader.getListOfFiles(src))),
+            ("walkFiles", lambda: streamed(src)),
+        ]
+
+        print("%-16s %8s %10s %12s %14s" % ("walker", "files", "seconds", "files/sec", "peak KiB"))
+        for label, run in runs:
+            # tracemalloc slows things down, so time and memory are measured apart
+            start = time.time()
+            count = run()
+            elapsed = time.time() - start
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-16s %8d %10.2f %12.0f %14.0f" % (label, count, elapsed, count / elapsed, peak / 1024.0))
+
+        start = time.time()
+        next(iter(uploader.walkFiles(src)))
+        print("first file from walkFiles after %.4fs" % (time.time() - start))
+    finally:
+        shutil.rmtree(workdir)
+
+
+@contextlib.contextmanager
+def slowScandir(latency):
+    # every directory listing pays a network round trip
+    realScandir = os.scandir
+
+    def scandir(path="."):
+        time.sleep(latency)
+        return realScandir(path)
+
+    os.scandir = scandir
+    try:
+        yield
+    finally:
+        os.scandir = realScandir
+
+
+def bench_parallelwalk(args):
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeDeepTree(src, args.depth, args.width, args.files)
+
+        runs = [("walkFiles", lambda: uploader.walkFiles(src))]
+        for workers in args.workers:
+            runs.append(("parallel %d" % workers, lambda workers=workers: uploader.walkFilesParallel(src, workers)))
+            runs.append(("ordered %d" % workers,
+                         lambda workers=workers: uploader.walkFilesParallel(src, workers, ordered=True)))
+
+        print("%d folders, %.1f ms per listing" % (sum(args.width ** level for level in range(args.depth + 1)),
+                                                   args.latency * 1000))
+        print("%-14s %8s %10s %12s" % ("walker", "files", "seconds", "files/sec"))
+        with slowScandir(args.latency):
+            for label, walk in runs:
+                start = time.time()
+                count = sum(1 for entry in walk())
+                elapsed = time.time() - start
+                print("%-14s %8d %10.2f %12.0f" % (label, count, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_index(args):
+    # walkFiles against the scan index, cold and on an unchanged tree
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeDeepTree(src, args.depth, args.width, args.files)
+        # an index listing is only trusted once its folder is a little older
+        old = time.time() - 60
+        for folder, dirs, files in os.walk(src):
+            os.utime(folder, (old, old))
+        dbPath = os.path.join(workdir, "scan.db")
+
+        def indexed():
+            index = uploader.Scan_Index(dbPath)
+            try:
+                return sum(1 for entry in uploader.walkFilesIndexed(src, index))
+            finally:
+                index.close()
+
+        print("%d folders, %.1f ms per listing" % (sum(args.width ** level for level in range(args.depth + 1)),
+                                                   args.latency * 1000))
+        print("%-14s %8s %10s %12s" % ("walker", "files", "seconds", "files/sec"))
+        with slowScandir(args.latency):
+            for label, run in (("walkFiles", lambda: sum(1 for entry in uploader.walkFiles(src))),
+                               ("index cold", indexed), ("index warm", indexed)):
+                start = time.time()
+                count = run()
+                elapsed = time.time() - start
+                print("%-14s %8d %10.2f %12.0f" % (label, count, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_filter(args):
+    # a kept tree next to a big excluded one (think .git or node_modules):
+    # filtering the full listing against pruning while walking
+    workdir = tempfile.mkdtemp(prefix="gcp_bench_")
+    try:
+        src = os.path.join(workdir, "src")
+        makeDeepTree(os.path.join(src, "kept"), args.depth, args.width, args.files)
+        makeDeepTree(os.path.join(src, "build"), args.depth + 1, args.width, args.files)
+        fileFilter = uploader.File_Filter(["build/", "*.tmp"])
+        rootLen = len(src) + 1
+
+        def filtered():
+            return sum(1 for entry in uploader.walkFiles(src)
+                       if not fileFilter.excludes(entry.path[rootLen:], entry.size, entry.mtime))
+
+        def pruned():
+            return sum(1 for entry in uploader.walkFiles(src, fileFilter=fileFilter))
+
+        print("%-16s %8s %10s %12s" % ("walker", "files", "seconds", "files/sec"))
+        for label, run in (("filter after", filtered), ("prune during", pruned)):
+            start = time.time()
+            count = run()
+            elapsed = time.time() - start
+            print("%-16s %8d %10.2f %12.0f" % (label, count, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def legacyZen2han(text="", ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+    # MOJI.zen2han as it was before str.translate, for comparison
+    tables = moji._loadTables()
+    result = []
+    for c in text:
+        if c in ignore:
+            result.append(c)
+        elif ascii_ and (c in tables["ascii_zh"]):
+            result.append(tables["ascii_zh"][c])
+        elif digit and (c in tables["digit_zh"]):
+            result.append(tables["digit_zh"][c])
+        elif kana and (c in tables["kana_ten_zh"]):
+            result.append(tables["kana_ten_zh"][c] + u'ﾞ')
+        elif kana and (c in tables["kana_maru_zh"]):
+            result.append(tables["kana_maru_zh"][c] + u'ﾟ')
+        elif kakko and (c in tables["kakko_zh"]):
+            result.append(tables["kakko_zh"][c])
+        else:
+            result.append(c)
+    return "".join(result)
+
+
+def legacyHan2zen(text, ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+    # MOJI.han2zen as it was, with text[i+1] guarded so a trailing kana works
+    tables = moji._loadTables()
+    result = []
+    for i, c in enumerate(text):
+        following = text[i + 1] if i + 1 < len(text) else u''
+        if c == u'ﾞ' or c == u'ﾟ':
+            continue
+        elif c in ignore:
+            result.append(c)
+        elif ascii_ and (c in tables["ascii_hz"]):
+            result.append(tables["ascii_hz"][c])
+        elif digit and (c in tables["digit_hz"]):
+            result.append(tables["digit_hz"][c])
+        elif kana and (c in tables["kana_ten_hz"]) and (following == u'ﾞ'):
+            result.append(tables["kana_ten_hz"][c])
+        elif kana and (c in tables["kana_maru_hz"]) and (following == u'ﾟ'):
+            result.append(tables["kana_maru_hz"][c])
+        elif kana and (c in tables["kana_hz"]):
+            result.append(tables["kana_hz"][c])
+        elif kakko and (c in tables["kakko_hz"]):
+            result.append(tables["kakko_hz"][c])
+        else:
+            result.append(c)
+    return "".join(result)
+
+
+def sampleNames(count, seed=1):
+    # file names mixing ASCII, zenkaku, hankaku kana with marks and kanji
+    alphabet = (list(moji.ASCII_ZENKAKU_CHARS + moji.ASCII_HANKAKU_CHARS + moji.KANA_HANKAKU_CHARS +
+                     moji.DIGIT_ZENKAKU_CHARS + moji.KANA_ZENKAKU_CHARS) +
+                [z for z, h in moji.KANA_TEN_MAP + moji.KANA_MARU_MAP] + list(u'請求書報告会議資料_-.'))
+    rng = random.Random(seed)
+    return [u"".join(rng.choice(alphabet) for _ in range(rng.randint(4, 40))) for _ in range(count)]
+
+
+def bench_moji(args):
+    names = sampleNames(args.names)
+    runs = [
+        ("zen2han loop", lambda: [legacyZen2han(name) for name in names]),
+        ("zen2han", lambda: [moji.MOJI.zen2han(name) for name in names]),
+        ("zen2han_all", lambda: moji.MOJI.zen2han_all(names)),
+        ("han2zen loop", lambda: [legacyHan2zen(name) for name in names]),
+        ("han2zen", lambda: [moji.MOJI.han2zen(name) for name in names]),
+        ("han2zen_all", lambda: moji.MOJI.han2zen_all(names)),
+    ]
+    print("%d names, %d characters" % (len(names), sum(len(name) for name in names)))
+    print("%-14s %10s %12s %8s" % ("conversion", "ms", "names/sec", "same"))
+    reference = {}
+    for label, run in runs:
+        times = []
+        for _ in range(args.runs):
+            start = time.time()
+            output = run()
+            times.append(time.time() - start)
+        best = min(times)
+        same = reference.setdefault(label.split()[0].split("_")[0], output) == output
+        print("%-14s %10.1f %12.0f %8s" % (label, best * 1000, len(names) / best, "yes" if same else "NO"))
+
+
+def bench_names(args):
+    # object name normalization: the whole path through MOJI for every file
+    # against Name_Normalizer's memoized components
+    rng = random.Random(3)
+    folders = [u"/".join(rng.choice(sampleNames(50, 5)) for _ in range(args.depth)) for _ in range(args.folders)]
+    names = sampleNames(args.files, 9)
+    paths = [u"src/%s/%s" % (rng.choice(folders), name) for name in names]
+
+    def uncached():
+        return [u"/".join(moji.MOJI.zen2han(part, kana=False, ignore=u'／') for part in path.split(u"/"))
+                for path in paths]
+
+    def memoized():
+        normalizer = uploader.Name_Normalizer()
+        return [normalizer.name("src", path, path) for path in paths]
+
+    print("%d files in %d folders, %d levels deep" % (len(paths), len(folders), args.depth))
+    print("%-12s %10s %12s" % ("names", "ms", "files/sec"))
+    for label, run in (("per file", uncached), ("memoized", memoized)):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        print("%-12s %10.1f %12.0f" % (label, elapsed * 1000, len(paths) / elapsed))
+
+
+def bench_table(args):
+    # result rows appended to the GUI table one insert_row() at a time
+    # against append_rows(); needs a display
+    import tkinter
+    import index
+    root = tkinter.Tk()
+    root.withdraw()
+    rows = [["2020-05-20 12:00:%02d" % (i % 60), "OK folder/file%06d.txt" % i] for i in range(args.rows)]
+
+    def oneByOne(table):
+        for row in rows:
+            table.insert_row(row)
+
+    def batched(table):
+        table.append_rows(rows)
+
+    runs = [("Table", index.Table, oneByOne), ("Table", index.Table, batched),
+            ("Virtual_Table", index.Virtual_Table, oneByOne), ("Virtual_Table", index.Virtual_Table, batched)]
+    print("%d rows" % len(rows))
+    print("%-14s %-12s %10s %12s" % ("widget", "append", "seconds", "rows/sec"))
+    try:
+        for label, widget, run in runs:
+            if label == "Table" and run is oneByOne and len(rows) > args.slow_limit:
+                print("%-14s %-12s %10s %12s" % (label, "insert_row", "skipped", "(--slow-limit)"))
+                continue
+            table = widget(root, ["Date", "Result"], column_minwidths=[10, 400])
+            table.pack()
+            start = time.time()
+            run(table)
+            # the deferred redraw is part of the cost
+            root.update()
+            elapsed = time.time() - start
+            print("%-14s %-12s %10.2f %12.0f" % (label, "insert_row" if run is oneByOne else "append_rows",
+                                                 elapsed, len(rows) / elapsed))
+            table.destroy()
+    finally:
+        root.destroy()
+
+
+IMPORT_PROBE = ("import sys, time; start = time.perf_counter(); import %s; "
+                "print(time.perf_counter() - start, 'tkinter' in sys.modules)")
+
+
+def bench_importtime(args):
+    # fresh interpreter per run so nothing is already in sys.modules
+    here = os.path.dirname(os.path.abspath(__file__))
+    print("%-10s %10s %10s %10s" % ("module", "median ms", "min ms", "tkinter"))
+    for module in args.modules:
+        times = []
+        for _ in range(args.runs):
+            output = subprocess.check_output([sys.executable, "-c", IMPORT_PROBE % module], cwd=here)
+            seconds, tkinter = output.decode().split()
+            times.append(float(seconds) * 1000)
+        print("%-10s %10.1f %10.1f %10s" % (module, statistics.median(times), min(times),
+                                            "yes" if tkinter == "True" else "no"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="upload pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="name")
+
+    p = subparsers.add_parser("workers", help="files/sec as the worker pool grows")
+    p.add_argument("--files", type=int, default=200)
+    p.add_argument("--startup", type=float, default=0.05,
+                   help="seconds the fake gsutil sleeps before copying")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p.set_defaults(func=bench_workers)
+
+    p = subparsers.add_parser("batch", help="per-file processes against batched cp -I")
+    p.add_argument("--files", type=int, default=400)
+    p.add_argument("--startup", type=float, default=0.05)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 10, 100])
+    p.set_defaults(func=bench_batch)
+
+    p = subparsers.add_parser("backends", help="files/sec for each transport backend")
+    p.add_argument("--files", type=int, default=400)
+    p.add_argument("--size", type=int, default=1024)
+    p.add_argument("--startup", type=float, default=0.05)
+    p.add_argument("--workers", type=int, default=8)
+    p.set_defaults(func=bench_backends)
+
+    p = subparsers.add_parser("hash", help="hash engine throughput, cold and cached")
+    p.add_argument("--files", type=int, default=200)
+    p.add_argument("--size", type=int, default=256 * 1024)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    p.add_argument("--algorithms", nargs="+", default=list(uploader.HASH_ALGORITHMS))
+    p.set_defaults(func=bench_hash)
+
+    p = subparsers.add_parser("composite", help="single stream against parallel composite slices")
+    p.add_argument("--size", type=int, default=256, help="file size in MB")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--slices", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_composite)
+
+    p = subparsers.add_parser("client", help="plain, gzip, throttled and composite uploads with the client backend")
+    p.add_argument("destination", help="gs://bucket[/prefix] to write test objects under (STORAGE_EMULATOR_HOST "
+                                       "points the client at an emulator)")
+    p.add_argument("--size", type=int, default=40, help="file size in MB")
+    p.add_argument("--workers", type=int, default=8)
+    p.set_defaults(func=bench_client)
+
+    p = subparsers.add_parser("schedule", help="simulated makespan of each scheduling strategy")
+    p.add_argument("--files", type=int, default=5000)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--bandwidth", type=float, default=10, help="MB/s per worker")
+    p.add_argument("--overhead", type=float, default=0.05, help="seconds per file")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_schedule)
+
+    p = subparsers.add_parser("engines", help="serial loop, thread pool and asyncio engine, one process per file")
+    p.add_argument("--files", type=int, default=400)
+    p.add_argument("--startup", type=float, default=0.05)
+    p.add_argument("--workers", type=int, nargs="+", default=[8, 64])
+    p.set_defaults(func=bench_engines)
+
+    p = subparsers.add_parser("walk", help="directory walkers on a synthetic deep tree")
+    p.add_argument("--depth", type=int, default=6)
+    p.add_argument("--width", type=int, default=3)
+    p.add_argument("--files", type=int, default=40, help="files per folder")
+    p.set_defaults(func=bench_walk)
+
+    p = subparsers.add_parser("parallelwalk", help="serial and parallel walkers with per-listing latency")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--width", type=int, default=8)
+    p.add_argument("--files", type=int, default=20, help="files per folder")
+    p.add_argument("--latency", type=float, default=0.005, help="seconds added to every scandir call")
+    p.add_argument("--workers", type=int, nargs="+", default=[4, 16, 64])
+    p.set_defaults(func=bench_parallelwalk)
+
+    p = subparsers.add_parser("index", help="walkFiles against the persistent scan index, cold and warm")
+    p.add_argument("--depth", type=int, default=5)
+    p.add_argument("--width", type=int, default=4)
+    p.add_argument("--files", type=int, default=50)
+    p.add_argument("--latency", type=float, default=0.001, help="seconds added to every directory listing")
+    p.set_defaults(func=bench_index)
+
+    p = subparsers.add_parser("filter", help="exclude rules applied after the walk against pruning during it")
+    p.add_argument("--depth", type=int, default=5)
+    p.add_argument("--width", type=int, default=3)
+    p.add_argument("--files", type=int, default=20)
+    p.set_defaults(func=bench_filter)
+
+    p = subparsers.add_parser("moji", help="MOJI conversions against the old per-character loop")
+    p.add_argument("--names", type=int, default=20000)
+    p.add_argument("--runs", type=int, default=5)
+    p.set_defaults(func=bench_moji)
+
+    p = subparsers.add_parser("names", help="object name normalization, per file against memoized components")
+    p.add_argument("--files", type=int, default=50000)
+    p.add_argument("--folders", type=int, default=200)
+    p.add_argument("--depth", type=int, default=4)
+    p.set_defaults(func=bench_names)
+
+    p = subparsers.add_parser("table", help="appending result rows to the GUI table, one by one and batched")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--slow-limit", type=int, default=10000,
+                   help="skip Table.insert_row above this many rows, it redraws everything per row")
+    p.set_defaults(func=bench_table)
+
+    p = subparsers.add_parser("importtime", help="cold import cost of the engine against the GUI")
+    p.add_argument("--runs", type=int, default=20)
+    p.add_argument("--modules", nargs="+", default=["uploader", "moji", "index"])
+    p.set_defaults(func=bench_importtime)
+
+    args = parser.parse_args()
+    if not getattr(args, "func", None):
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,212 +4,24 @@
 # Author: Santosh Rai
 # Version: 1.00 (20200520)
 # upload files to GCP with gsutil
+# GUI only; the upload engine and the headless command line live in uploader.py
+# needs Python 3.7 or newer
 
-import platform
 import os
-import io
-import sys
-import codecs
-import csv
-import subprocess
+import contextlib
 import datetime as dt
 
-sys.stdout = codecs.getwriter("utf-8")(sys.stdout)
-
-if sys.version_info[0] == 3:
-    # for Python3
-    from tkinter import Frame, Label, Message, StringVar, Canvas, Button, Menu, DoubleVar
-    import tkinter.filedialog as filedialogprompt
-    from tkinter.ttk import Scrollbar
-    from tkinter.constants import *
-    import time
-    from tkinter import ttk
-    from tkinter import messagebox as message_box
-
-
-else:
-    # for Python2
-    from Tkinter import Frame, Label, Message, StringVar, Canvas, Button, Menu, DoubleVar
-    import tkFileDialog as filedialogprompt
-    from ttk import Scrollbar
-    from Tkconstants import *
-    import time
-    import tkMessageBox as message_box
-
-
-OS = platform.system()
-
-ASCII_ZENKAKU_CHARS = (
-    u'ａ', u'ｂ', u'ｃ', u'ｄ', u'ｅ', u'ｆ', u'ｇ', u'ｈ', u'ｉ', u'ｊ', u'ｋ',
-    u'ｌ', u'ｍ', u'ｎ', u'ｏ', u'ｐ', u'ｑ', u'ｒ', u'ｓ', u'ｔ', u'ｕ', u'ｖ',
-    u'ｗ', u'ｘ', u'ｙ', u'ｚ',
-    u'Ａ', u'Ｂ', u'Ｃ', u'Ｄ', u'Ｅ', u'Ｆ', u'Ｇ', u'Ｈ', u'Ｉ', u'Ｊ', u'Ｋ',
-    u'Ｌ', u'Ｍ', u'Ｎ', u'Ｏ', u'Ｐ', u'Ｑ', u'Ｒ', u'Ｓ', u'Ｔ', u'Ｕ', u'Ｖ',
-    u'Ｗ', u'Ｘ', u'Ｙ', u'Ｚ',
-    u'！', u'”', u'＃', u'＄', u'％', u'＆', u'’', u'（', u'）', u'＊', u'＋',
-    u'，', u'－', u'．', u'／', u'：', u'；', u'＜', u'＝', u'＞', u'？', u'＠',
-    u'［', u'￥', u'］', u'＾', u'＿', u'‘', u'｛', u'｜', u'｝', u'～', u'　'
-)
-
-ASCII_HANKAKU_CHARS = (
-    u'a', u'b', u'c', u'd', u'e', u'f', u'g', u'h', u'i', u'j', u'k',
-    u'l', u'm', u'n', u'o', u'p', u'q', u'r', u's', u't', u'u', u'v',
-    u'w', u'x', u'y', u'z',
-    u'A', u'B', u'C', u'D', u'E', u'F', u'G', u'H', u'I', u'J', u'K',
-    u'L', u'M', u'N', u'O', u'P', u'Q', u'R', u'S', u'T', u'U', u'V',
-    u'W', u'X', u'Y', u'Z',
-    u'!', u'"', u'#', u'$', u'%', u'&', u'\'', u'(', u')', u'*', u'+',
-    u',', u'-', u'.', u'/', u':', u';', u'<', u'=', u'>', u'?', u'@',
-    u'[', u"¥", u']', u'^', u'_', u'`', u'{', u'|', u'}', u'~', u' '
-)
-
-KANA_ZENKAKU_CHARS = (
-    u'ア', u'イ', u'ウ', u'エ', u'オ', u'カ', u'キ', u'ク', u'ケ', u'コ',
-    u'サ', u'シ', u'ス', u'セ', u'ソ', u'タ', u'チ', u'ツ', u'テ', u'ト',
-    u'ナ', u'ニ', u'ヌ', u'ネ', u'ノ', u'ハ', u'ヒ', u'フ', u'ヘ', u'ホ',
-    u'マ', u'ミ', u'ム', u'メ', u'モ', u'ヤ', u'ユ', u'ヨ',
-    u'ラ', u'リ', u'ル', u'レ', u'ロ', u'ワ', u'ヲ', u'ン',
-    u'ァ', u'ィ', u'ゥ', u'ェ', u'ォ', u'ッ', u'ャ', u'ュ', u'ョ',
-    u'。', u'、', u'・', u'゛', u'゜', u'「', u'」', u'ー'
-)
-
-KANA_HANKAKU_CHARS = (
-    u'ｱ', u'ｲ', u'ｳ', u'ｴ', u'ｵ', u'ｶ', u'ｷ', u'ｸ', u'ｹ', u'ｺ',
-    u'ｻ', u'ｼ', u'ｽ', u'ｾ', u'ｿ', u'ﾀ', u'ﾁ', u'ﾂ', u'ﾃ', u'ﾄ',
-    u'ﾅ', u'ﾆ', u'ﾇ', u'ﾈ', u'ﾉ', u'ﾊ', u'ﾋ', u'ﾌ', u'ﾍ', u'ﾎ',
-    u'ﾏ', u'ﾐ', u'ﾑ', u'ﾒ', u'ﾓ', u'ﾔ', u'ﾕ', u'ﾖ',
-    u'ﾗ', u'ﾘ', u'ﾙ', u'ﾚ', u'ﾛ', u'ﾜ', u'ｦ', u'ﾝ',
-    u'ｧ', u'ｨ', u'ｩ', u'ｪ', u'ｫ', u'ｯ', u'ｬ', u'ｭ', u'ｮ',
-    u'｡', u'､', u'･', u'ﾞ', u'ﾟ', u'｢', u'｣', u'ｰ'
-)
-
-DIGIT_ZENKAKU_CHARS = (
-    u'０', u'１', u'２', u'３', u'４', u'５', u'６', u'７', u'８', u'９'
-)
-
-DIGIT_HANKAKU_CHARS = (
-    u'0', u'1', u'2', u'3', u'4', u'5', u'6', u'7', u'8', u'9'
-)
-
-KANA_TEN_MAP = (
-    (u'ガ', u'ｶ'), (u'ギ', u'ｷ'), (u'グ', u'ｸ'), (u'ゲ', u'ｹ'), (u'ゴ', u'ｺ'),
-    (u'ザ', u'ｻ'), (u'ジ', u'ｼ'), (u'ズ', u'ｽ'), (u'ゼ', u'ｾ'), (u'ゾ', u'ｿ'),
-    (u'ダ', u'ﾀ'), (u'ヂ', u'ﾁ'), (u'ヅ', u'ﾂ'), (u'デ', u'ﾃ'), (u'ド', u'ﾄ'),
-    (u'バ', u'ﾊ'), (u'ビ', u'ﾋ'), (u'ブ', u'ﾌ'), (u'ベ', u'ﾍ'), (u'ボ', u'ﾎ'),
-    (u'ヴ', u'ｳ')
-)
-
-KANA_MARU_MAP = (
-    (u'パ', u'ﾊ'), (u'ピ', u'ﾋ'), (u'プ', u'ﾌ'), (u'ペ', u'ﾍ'), (u'ポ', u'ﾎ')
-)
-
-
-ascii_zh_table = {}
-ascii_hz_table = {}
-kana_zh_table = {}
-kana_hz_table = {}
-digit_zh_table = {}
-digit_hz_table = {}
-
-for (az, ah) in zip(ASCII_ZENKAKU_CHARS, ASCII_HANKAKU_CHARS):
-    ascii_zh_table[az] = ah
-    ascii_hz_table[ah] = az
-
-for (kz, kh) in zip(KANA_ZENKAKU_CHARS, KANA_HANKAKU_CHARS):
-    kana_zh_table[kz] = kh
-    kana_hz_table[kh] = kz
-
-for (dz, dh) in zip(DIGIT_ZENKAKU_CHARS, DIGIT_HANKAKU_CHARS):
-    digit_zh_table[dz] = dh
-    digit_hz_table[dh] = dz
-
-kana_ten_zh_table = {}
-kana_ten_hz_table = {}
-kana_maru_zh_table = {}
-kana_maru_hz_table = {}
-
-for (ktz, kth) in KANA_TEN_MAP:
-    kana_ten_zh_table[ktz] = kth
-    kana_ten_hz_table[kth] = ktz
-
-for (kmz, kmh) in KANA_MARU_MAP:
-    kana_maru_zh_table[kmz] = kmh
-    kana_maru_hz_table[kmh] = kmz
-
-del ASCII_ZENKAKU_CHARS, ASCII_HANKAKU_CHARS, \
-    KANA_ZENKAKU_CHARS, KANA_HANKAKU_CHARS,\
-    DIGIT_ZENKAKU_CHARS, DIGIT_HANKAKU_CHARS,\
-    KANA_TEN_MAP, KANA_MARU_MAP
-
-kakko_zh_table = {
-    u'｟': u'⦅', u'｠': u'⦆',
-    u'『': u'｢', u'』': u'｣',
-    u'〚': u'⟦', u'〛': u'⟧',
-    u'〔': u'❲', u'〕': u'❳',
-    u'〘': u'⟬', u'〙': u'⟭',
-    u'《': u'⟪', u'》': u'⟫',
-    u'【': u'(', u'】': u')',
-    u'〖': u'(', u'〗': u')'
-}
-
-kakko_hz_table = {}
-for k, v in kakko_zh_table.items():
-    kakko_hz_table[v] = k
-
-
-
-
-class MOJI:
-    @staticmethod
-    def zen2han(text="", ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
-        
-        result = []
-
-        for c in text:
-            if c in ignore:
-                result.append(c)
-            elif ascii_ and (c in ascii_zh_table):
-                result.append(ascii_zh_table[c])
-            elif digit and (c in digit_zh_table):
-                result.append(digit_zh_table[c])
-            # elif kana and (c in kana_zh_table):
-            #     result.append(kana_zh_table[c])
-            elif kana and (c in kana_ten_zh_table):
-                result.append(kana_ten_zh_table[c] + u'ﾞ')
-            elif kana and (c in kana_maru_zh_table):
-                result.append(kana_maru_zh_table[c] + u'ﾟ')
-            elif kakko and (c in kakko_zh_table):
-                result.append(kakko_zh_table[c])
-            else:
-                result.append(c)
-
-        return "".join(result)
+from uploader import OS, loadConfig, getTransport, uploadPipeline, writeCSV, formatRate
+from moji import MOJI
 
-    @staticmethod
-    def han2zen(text, ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
-        result = []
-
-        for i, c in enumerate(text):
-            if c == u'ﾞ' or c == u'ﾟ':
-                continue
-            elif c in ignore:
-                result.append(c)
-            elif ascii_ and (c in ascii_hz_table):
-                result.append(ascii_hz_table[c])
-            elif digit and (c in digit_hz_table):
-                result.append(digit_hz_table[c])
-            elif kana and (c in kana_ten_hz_table) and (text[i+1] == u'ﾞ'):
-                result.append(kana_ten_hz_table[c])
-            elif kana and (c in kana_maru_hz_table) and (text[i+1] == u'ﾟ'):
-                result.append(kana_maru_hz_table[c])
-            elif kana and (c in kana_hz_table):
-                result.append(kana_hz_table[c])
-            elif kakko and (c in kakko_hz_table):
-                result.append(kakko_hz_table[c])
-            else:
-                result.append(c)
+from tkinter import Tk, Frame, Label, Message, StringVar, Canvas, Button, Menu, DoubleVar
+import tkinter.filedialog as filedialogprompt
+from tkinter.ttk import Scrollbar
+from tkinter.constants import *
+import time
+from tkinter import ttk
+from tkinter import messagebox as message_box
 
-        return "".join(result)
 
 class Mousewheel_Support(object):
 
@@ -435,6 +247,20 @@ class Data_Cell(Cell):
             expand=True, padx=padx, pady=pady, anchor=anchor)
 
 
+class Line_Cell(Cell):
+    """Data cell of one text line; long values are clipped instead of wrapped,
+    so every row has the same height"""
+
+    def __init__(self, master, variable, anchor=W, bordercolor=None, borderwidth=1, padx=0, pady=0, background=None, foreground=None, font=None):
+        Cell.__init__(self, master, background=background, highlightbackground=bordercolor,
+                      highlightcolor=bordercolor, highlightthickness=borderwidth, bd=0)
+
+        self._label_widget = Label(
+            self, textvariable=variable, font=font, background=background, foreground=foreground, anchor=anchor, height=1)
+        self._label_widget.pack(
+            fill=X, padx=padx, pady=pady)
+
+
 class Header_Cell(Cell):
     def __init__(self, master, text, bordercolor=None, borderwidth=1, padx=0, pady=0, background=None, foreground=None, font=None, anchor=CENTER, separator=True):
         Cell.__init__(self, master, background=background, highlightbackground=bordercolor,
@@ -552,6 +378,11 @@ class Table(Frame):
 
         self._on_change_data = on_change_data
 
+        # see batch()
+        self._batch_depth = 0
+        self._batch_changed = False
+        self._idle_job = None
+
     def _append_n_rows(self, n):
         number_of_rows = self._number_of_rows
         number_of_columns = self._number_of_columns
@@ -609,7 +440,7 @@ class Table(Frame):
             for j in range(m):
                 self._data_vars[i][j].set(data[i][j])
 
-        if self._on_change_data is not None: self._on_change_data()
+        self._data_changed()
 
     def get_data(self):
         number_of_rows = self._number_of_rows
@@ -654,7 +485,7 @@ class Table(Frame):
             for j in range(number_of_columns):
                 row_of_vars[index][j].set(data[j])
 
-            if self._on_change_data is not None: self._on_change_data()
+            self._data_changed()
 
     def column(self, index, data=None):
         number_of_rows = self._number_of_rows
@@ -674,7 +505,7 @@ class Table(Frame):
             for i in range(number_of_columns):
                 self._data_vars[i][index].set(data[i])
 
-            if self._on_change_data is not None: self._on_change_data()
+            self._data_changed()
 
     def clear(self):
         number_of_rows = self._number_of_rows
@@ -684,7 +515,7 @@ class Table(Frame):
             for j in range(number_of_columns):
                 self._data_vars[i][j].set("")
 
-        if self._on_change_data is not None: self._on_change_data()
+        self._data_changed()
 
     def delete_row(self, index):
         i = index
@@ -700,7 +531,7 @@ class Table(Frame):
 
         self._pop_n_rows(1)
 
-        if self._on_change_data is not None: self._on_change_data()
+        self._data_changed()
 
     def insert_row(self, data, index=END):
         self._append_n_rows(1)
@@ -715,7 +546,7 @@ class Table(Frame):
 
             j = 0
             while j < self.number_of_columns:
-                row_of_vars_2[j].set(row_of_vars_1[j])
+                row_of_vars_2[j].set(row_of_vars_1[j].get())
                 j += 1
             i -= 1
 
@@ -723,7 +554,7 @@ class Table(Frame):
         for cell_var, cell_data in zip(list_of_cell_vars, data):
             cell_var.set(cell_data)
 
-        if self._on_change_data is not None: self._on_change_data()
+        self._data_changed()
 
     def cell(self, row, column, data=None):
         """Get the value of a table cell"""
@@ -731,7 +562,7 @@ class Table(Frame):
             return self._data_vars[row][column].get()
         else:
             self._data_vars[row][column].set(data)
-            if self._on_change_data is not None: self._on_change_data()
+            self._data_changed()
 
     def __getitem__(self, index):
         if isinstance(index, tuple):
@@ -750,6 +581,248 @@ class Table(Frame):
     def on_change_data(self, callback):
         self._on_change_data = callback
 
+    def _redraw(self):
+        if self._on_change_data is not None: self._on_change_data()
+
+    def _data_changed(self):
+        if self._batch_depth:
+            self._batch_changed = True
+        else:
+            self._redraw()
+
+    def _flush(self):
+        self._idle_job = None
+        self._redraw()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Apply many changes with one redraw, queued with after_idle when the outermost batch ends"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_changed:
+                self._batch_changed = False
+                if self._idle_job is None:
+                    self._idle_job = self.after_idle(self._flush)
+
+    def append_rows(self, rows):
+        """Add rows at the end with one grid pass and one redraw"""
+        rows = list(rows)
+        if not rows:
+            return
+        first = self._number_of_rows
+        with self.batch():
+            self._append_n_rows(len(rows))
+            for row_of_vars, data in zip(self._data_vars[first:], rows):
+                for cell_var, cell_data in zip(row_of_vars, data):
+                    cell_var.set(cell_data)
+            self._data_changed()
+
+
+class Virtual_Table(Table):
+    """Table whose rows live in a plain list; only a pool of row widgets
+    that fits the body exists, and scrolling refills it"""
+
+    def __init__(self, master, columns, height=500, **kw):
+        kw["scroll_horizontally"] = False
+        kw["scroll_vertically"] = False
+        Table.__init__(self, master, columns, height=height, **kw)
+        # the body keeps the size the layout gives it, whatever the rows ask for
+        self._body.grid_propagate(False)
+
+        self._rows = []
+        self._first = 0
+
+        self._pool = 0
+        self._cells = []
+        # what every pool row shows: (row index, values), None while hidden
+        self._shown = []
+
+        self._yscrollbar = Scrollbar(self, orient=VERTICAL, command=self.yview)
+        self._yscrollbar.grid(row=1, column=1, sticky=N+S)
+
+        # cells hold one line, so the first row gives the height of all of them
+        self._append_n_rows(1)
+        self._body.update_idletasks()
+        self._row_height = max(1, max(cell.winfo_reqheight() for cell in self._cells[0]))
+        self._resize(height)
+        self._body.bind("<Configure>", lambda event: self._resize(event.height), add="+")
+
+        Mousewheel_Support(self).add_support_to(self, yscrollbar=self._yscrollbar)
+
+    def _append_n_rows(self, n):
+        for k in range(self._pool, self._pool + n):
+            row_of_vars = []
+            row_of_cells = []
+            for j in range(self._number_of_columns):
+                var = StringVar()
+                cell = Line_Cell(self._body, borderwidth=self._innerborder_width, variable=var, bordercolor=self._bordercolor, padx=self._padx,
+                                 pady=self._pady, background=self._cell_background, foreground=self._cell_foreground, font=self._cell_font, anchor=self._cell_anchor)
+                cell.grid(row=k, column=j, sticky=N+E+W+S)
+                cell.grid_remove()
+                row_of_vars.append(var)
+                row_of_cells.append(cell)
+
+            if k == 0:
+                for j, cell in enumerate(row_of_cells):
+                    header_cell = self._head.grid_slaves(row=0, column=j)[0]
+                    cell.bind("<Configure>", lambda event, header_cell=header_cell: header_cell.configure(
+                        width=event.width), add="+")
+
+            self._data_vars.append(row_of_vars)
+            self._cells.append(row_of_cells)
+            self._shown.append(None)
+
+        self._pool += n
+        self._number_of_rows = self._pool
+
+    def _pop_n_rows(self, n):
+        for row_of_cells in self._cells[-n:]:
+            for cell in row_of_cells:
+                cell.destroy()
+        del self._data_vars[-n:], self._cells[-n:], self._shown[-n:]
+
+        self._pool -= n
+        self._number_of_rows = self._pool
+
+    def _resize(self, height):
+        # as many rows as fit inside the body's border
+        border = int(self._body.cget("highlightthickness"))
+        fit = max(1, (height - 2*border) // self._row_height)
+        if fit == self._pool:
+            return
+        if fit > self._pool:
+            self._append_n_rows(fit - self._pool)
+        else:
+            self._pop_n_rows(self._pool - fit)
+        self._refresh()
+
+    def _hide(self, k):
+        for cell in self._cells[k]:
+            cell.grid_remove()
+        self._shown[k] = None
+
+    def _refresh(self):
+        total = len(self._rows)
+        self._first = max(0, min(self._first, total - self._pool))
+
+        for k in range(self._pool):
+            i = self._first + k
+            if i >= total:
+                if self._shown[k] is not None:
+                    self._hide(k)
+                continue
+
+            values = self._rows[i]
+            shown = self._shown[k]
+            if shown is not None and shown[0] == i and shown[1] == values:
+                continue
+            if shown is None:
+                for cell in self._cells[k]:
+                    cell.grid()
+            if self._stripped_rows and (shown is None or shown[0] % 2 != i % 2):
+                background = self._stripped_rows[i % 2]
+                for cell in self._cells[k]:
+                    cell.configure(background=background)
+                    cell._label_widget.configure(background=background)
+            for var, value in zip(self._data_vars[k], values):
+                var.set(value)
+            self._shown[k] = (i, list(values))
+
+        if total > self._pool:
+            self._yscrollbar.set(float(self._first) / total, float(self._first + self._pool) / total)
+        else:
+            self._yscrollbar.set(0.0, 1.0)
+
+        if self._on_change_data is not None: self._on_change_data()
+
+    def _redraw(self):
+        self._refresh()
+
+    def yview(self, *args):
+        # Scrollbar command and mouse wheel: ("moveto", fraction) or
+        # ("scroll", n, "units" | "pages")
+        if args[0] == "moveto":
+            self._first = int(float(args[1]) * len(self._rows))
+        elif args[0] == "scroll":
+            self._first += int(args[1]) * (self._pool if args[2] == "pages" else 1)
+        self._refresh()
+
+    def see(self, index):
+        # scrolls row index into view
+        if index < self._first:
+            self._first = index
+        elif index >= self._first + self._pool:
+            self._first = index - self._pool + 1
+        self._refresh()
+
+    def _fit(self, data):
+        row = list(data)[:self._number_of_columns]
+        return row + [""] * (self._number_of_columns - len(row))
+
+    @property
+    def number_of_rows(self):
+        return len(self._rows)
+
+    def set_data(self, data):
+        self._rows = [self._fit(row) for row in data]
+        self._data_changed()
+
+    def get_data(self):
+        return [list(row) for row in self._rows]
+
+    def row(self, index, data=None):
+        if data is None:
+            return list(self._rows[index])
+
+        if len(data) != self._number_of_columns:
+            raise ValueError("data has no %d elements: %s" % (self._number_of_columns, data))
+        self._rows[index] = list(data)
+        self._data_changed()
+
+    def column(self, index, data=None):
+        if data is None:
+            return [row[index] for row in self._rows]
+
+        if len(data) != len(self._rows):
+            raise ValueError("data has no %d elements: %s" % (len(self._rows), data))
+        for row, value in zip(self._rows, data):
+            row[index] = value
+        self._data_changed()
+
+    def clear(self):
+        for row in self._rows:
+            row[:] = [""] * self._number_of_columns
+        self._data_changed()
+
+    def delete_row(self, index):
+        del self._rows[index]
+        self._data_changed()
+
+    def insert_row(self, data, index=END):
+        if index == END:
+            self.append_rows([data])
+        else:
+            self._rows.insert(index, self._fit(data))
+            self._data_changed()
+
+    def append_rows(self, rows):
+        # a view showing the last row keeps following new ones
+        following = self._first + self._pool >= len(self._rows)
+        self._rows.extend(self._fit(row) for row in rows)
+        if following:
+            self._first = len(self._rows) - self._pool
+        self._data_changed()
+
+    def cell(self, row, column, data=None):
+        """Get the value of a table cell"""
+        if data is None:
+            return self._rows[row][column]
+        self._rows[row][column] = data
+        self._data_changed()
+
 
 # class Window(Frame):
 #     def __init__(self, master=None):
@@ -773,50 +846,6 @@ class Table(Frame):
 #         exit()
 
 
-def getListOfFiles(dirName):
-    try:
-        # create a list of file and sub directories
-        # names in the given directory
-        listOfFile = os.listdir(dirName)
-        allFiles = list()
-        # Iterate over all the entries
-        for entry in listOfFile:
-            # Create full path
-            fullPath = os.path.join(dirName, entry).replace('\\', '/')
-            # If entry is a directory then get the list of files in this directory
-            if os.path.isdir(fullPath):
-                allFiles = allFiles + getListOfFiles(fullPath)
-            else:
-                allFiles.append(fullPath)
-
-        return allFiles
-    except (IOError, ValueError):
-        message_box.showwarning("Warning","指定されたパスが見つかりません")
-    except:
-        message_box.showwarning("Warning","An unexpected error occurred")
-        raise
-
-
-def runUploadCommand(importPath):
-    try:
-      
-        print(importPath)
-        # output = subprocess.check_output('move "%s" "%s"' % (importPath.encode('utf-8'),destPath), stderr=subprocess.STDOUT,shell=True)
-        output = subprocess.check_output('gsutil cp -r "%s" "%s"' % (importPath.encode('utf-8'), destPath), stderr=subprocess.STDOUT,
-                shell=True)
-        return output
-    except AssertionError as error:
-        # message_box.showwarning("Warning",'"%s"Upload出来ませんでした"'  % (importPath.encode('utf-8')))
-        # print(error)
-        return "NG"
-
-def writeCSV(data):
-    filename = 'GCP_Upload_' + str(dt.datetime.now().strftime('%Y%m%d%H%M')) +'.csv'
-    with open(filename, 'w+') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(data)
-    csvfile.close()
-
 def getFolderPath():
     progressbarframe.pack_forget()
     dirName = filedialogprompt.askdirectory()
@@ -841,6 +870,11 @@ def upload():
       if not dirName:
           message_box.showwarning("Warning","フォルダを選択してください。")
           return
+
+    # if destination not configured
+      if not config["destination"]:
+          message_box.showwarning("Warning","config.ini にアプロード先 (destination) を設定してください。")
+          return
       
     # showing progress bar
       progressbarframe.pack()
@@ -848,45 +882,48 @@ def upload():
     # showing selected folder
       folderPathlable.config(text= dirName)
       
-    # Get the list of all files in directory tree at given path
-      listOfFiles = getListOfFiles(dirName)
-      
-    # Create shared variable and set initial value.
-      MAX = len(listOfFiles)
-      k = 1
-      data = []
-      fileName = ""
-      result =""
+    # the folder is scanned while the first files are already uploading
+      if not os.path.isdir(dirName):
+          message_box.showwarning("Warning","指定されたパスが見つかりません")
+          progressbarframe.pack_forget()
+          return
       
-      progressbar["maximum"] = MAX
-       # Print the files
-      for elem in listOfFiles:
-            # progress_var.set(k)
-
-            # fileName = moji.zen2han(os.path.basename(elem))
-            # fileName = os.path.basename(elem)
-            # folderNamePath = os.path.dirname(elem)
-
-            # fullPath = folderNamePath + '/' + fileName
-            # print(fullPath)
-            # run gsutil command
-            result = runUploadCommand(elem)
-            
-            # add to userform table
-            # table.insert_row([k+1,elem,result])
-            data.append([k,elem.encode('utf-8'),result])
-            progressbar["value"] = k
+      progressbar["value"] = 0
+      csvName = []
+
+      def onProgress(done, total):
+            # total is an estimate until the scan has finished
+            progressbar["maximum"] = max(total, 1)
+            progressbar["value"] = done
+            throughputLabel.config(text="%s / %s" % (formatRate(transport.limiter.throughput()),
+                                                     formatRate(transport.limiter.byteRate())))
             progressbar.update()
-            k +=1
             root.update_idletasks()
-            time.sleep(0.02)
+
+      def onRows(data):
+            # show and write result on csv as the files finish
+            now = dt.datetime.now()
+            table.append_rows([[now, "%s %s" % (row[2], row[1])] for row in data])
+            if csvName:
+                  writeCSV(data, csvName[0])
+            else:
+                  csvName.append(writeCSV(data))
+
+      # object names go through MOJI.zen2han when normalize_names = true (config.ini)
+      # same engine as the command line (python uploader.py)
+      scanCounts = {}
+      results = uploadPipeline(dirName, config, transport, onProgress, onRows, scanCounts)
+      if not csvName:
+            writeCSV([])
 
       print ("****************")
       
-      # write result on csv
-      writeCSV(data)
+    # Create shared variable and set initial value.
+      MAX = sum(results.values())
 
       table.insert_row([dt.datetime.now(),"%s ファイルのアプロード作業を完了" %(str(MAX))])
+      if scanCounts.get("pruned"):
+            table.insert_row([dt.datetime.now(),"%s 件のファイル・フォルダを除外" %(str(scanCounts["pruned"]))])
 
       message_box.showinfo("報告","%s ファイルのアプロード作業を完了です。 確認してください。" %(str(MAX)))
       
@@ -922,14 +959,12 @@ def center(win):
 #       loginframe.pack_forget()
 
 if __name__ == "__main__":
-    try:
-        from Tkinter import Tk
-        import ttk
-    except ImportError:
-        from tkinter import Tk
-
     root = Tk()
 
+    # backend and destination come from config.ini
+    config = loadConfig()
+    transport = getTransport(config)
+
     # for window menu
     # app = Window(root)
     
@@ -955,7 +990,7 @@ if __name__ == "__main__":
 
     
     resultFrame = Frame(root,bg="skyblue",width=500)
-    resultFrame.pack( side = TOP )
+    resultFrame.pack( side = TOP, fill=BOTH, expand=True )
 
     pframe = Frame(uploadFrame,bg="skyblue",width=500)
     pframe.pack( side = BOTTOM )
@@ -998,7 +1033,7 @@ if __name__ == "__main__":
                     bg='blue', fg='white', font=('Meiryo UI', 12, 'bold'))
     uploadButton.pack(padx=5, pady=5,side="left")
 
-    uploadPath = Label(uploadFrame,text=destPath,
+    uploadPath = Label(uploadFrame,text=config["destination"],
                     bg='blue', fg='white', font=('Meiryo UI', 11, 'bold'))
     uploadPath.pack(padx=5, pady=5,side="left")
 
@@ -1009,14 +1044,20 @@ if __name__ == "__main__":
     progressbar = ttk.Progressbar(progressbarframe, orient = 'horizontal', length = 400, mode = 'determinate')
     progressbar.pack(padx=5, pady=5,fill=X)
 
+    # effective throughput next to the configured cap
+    throughputLabel = Label(progressbarframe, text="",bg="skyblue")
+    throughputLabel.pack(padx=5, pady=5,side="left")
+
     progressbarframe.pack_forget()
 
     # resultLabel = Label(resultFrame, text="Result",bg="skyblue")
     # resultLabel.pack(padx=5, pady=5,side="top")
 
     # table = Table(root, ["SN", "File Path", "File Name", "Result"], column_minwidths=[10, 400, None, None])
-    table = Table(resultFrame, ["Date", "Result"], column_minwidths=[10, 400])
-    table.pack(expand=False, fill=X,padx=10,pady=10)
+    # rows are kept in a list and drawn through as many widgets as fit below the header;
+    # the table takes whatever height is left in the window and follows it
+    table = Virtual_Table(resultFrame, ["Date", "Result"], column_minwidths=[10, 400], height=150)
+    table.pack(expand=True, fill=BOTH,padx=10,pady=10)
     
     root.update()
 
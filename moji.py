@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# zenkaku/hankaku conversion with str.translate(); the lookup tables are
+# built on first use so importing this module costs nothing
+
+import re
+
+ASCII_ZENKAKU_CHARS = (
+    u'ａ', u'ｂ', u'ｃ', u'ｄ', u'ｅ', u'ｆ', u'ｇ', u'ｈ', u'ｉ', u'ｊ', u'ｋ',
+    u'ｌ', u'ｍ', u'ｎ', u'ｏ', u'ｐ', u'ｑ', u'ｒ', u'ｓ', u'ｔ', u'ｕ', u'ｖ',
+    u'ｗ', u'ｘ', u'ｙ', u'ｚ',
+    u'Ａ', u'Ｂ', u'Ｃ', u'Ｄ', u'Ｅ', u'Ｆ', u'Ｇ', u'Ｈ', u'Ｉ', u'Ｊ', u'Ｋ',
+    u'Ｌ', u'Ｍ', u'Ｎ', u'Ｏ', u'Ｐ', u'Ｑ', u'Ｒ', u'Ｓ', u'Ｔ', u'Ｕ', u'Ｖ',
+    u'Ｗ', u'Ｘ', u'Ｙ', u'Ｚ',
+    u'！', u'”', u'＃', u'＄', u'％', u'＆', u'’', u'（', u'）', u'＊', u'＋',
+    u'，', u'－', u'．', u'／', u'：', u'；', u'＜', u'＝', u'＞', u'？', u'＠',
+    u'［', u'￥', u'］', u'＾', u'＿', u'‘', u'｛', u'｜', u'｝', u'～', u'　'
+)
+
+ASCII_HANKAKU_CHARS = (
+    u'a', u'b', u'c', u'd', u'e', u'f', u'g', u'h', u'i', u'j', u'k',
+    u'l', u'm', u'n', u'o', u'p', u'q', u'r', u's', u't', u'u', u'v',
+    u'w', u'x', u'y', u'z',
+    u'A', u'B', u'C', u'D', u'E', u'F', u'G', u'H', u'I', u'J', u'K',
+    u'L', u'M', u'N', u'O', u'P', u'Q', u'R', u'S', u'T', u'U', u'V',
+    u'W', u'X', u'Y', u'Z',
+    u'!', u'"', u'#', u'$', u'%', u'&', u'\'', u'(', u')', u'*', u'+',
+    u',', u'-', u'.', u'/', u':', u';', u'<', u'=', u'>', u'?', u'@',
+    u'[', u"¥", u']', u'^', u'_', u'`', u'{', u'|', u'}', u'~', u' '
+)
+
+KANA_ZENKAKU_CHARS = (
+    u'ア', u'イ', u'ウ', u'エ', u'オ', u'カ', u'キ', u'ク', u'ケ', u'コ',
+    u'サ', u'シ', u'ス', u'セ', u'ソ', u'タ', u'チ', u'ツ', u'テ', u'ト',
+    u'ナ', u'ニ', u'ヌ', u'ネ', u'ノ', u'ハ', u'ヒ', u'フ', u'ヘ', u'ホ',
+    u'マ', u'ミ', u'ム', u'メ', u'モ', u'ヤ', u'ユ', u'ヨ',
+    u'ラ', u'リ', u'ル', u'レ', u'ロ', u'ワ', u'ヲ', u'ン',
+    u'ァ', u'ィ', u'ゥ', u'ェ', u'ォ', u'ッ', u'ャ', u'ュ', u'ョ',
+    u'。', u'、', u'・', u'゛', u'゜', u'「', u'」', u'ー'
+)
+
+KANA_HANKAKU_CHARS = (
+    u'ｱ', u'ｲ', u'ｳ', u'ｴ', u'ｵ', u'ｶ', u'ｷ', u'ｸ', u'ｹ', u'ｺ',
+    u'ｻ', u'ｼ', u'ｽ', u'ｾ', u'ｿ', u'ﾀ', u'ﾁ', u'ﾂ', u'ﾃ', u'ﾄ',
+    u'ﾅ', u'ﾆ', u'ﾇ', u'ﾈ', u'ﾉ', u'ﾊ', u'ﾋ', u'ﾌ', u'ﾍ', u'ﾎ',
+    u'ﾏ', u'ﾐ', u'ﾑ', u'ﾒ', u'ﾓ', u'ﾔ', u'ﾕ', u'ﾖ',
+    u'ﾗ', u'ﾘ', u'ﾙ', u'ﾚ', u'ﾛ', u'ﾜ', u'ｦ', u'ﾝ',
+    u'ｧ', u'ｨ', u'ｩ', u'ｪ', u'ｫ', u'ｯ', u'ｬ', u'ｭ', u'ｮ',
+    u'｡', u'､', u'･', u'ﾞ', u'ﾟ', u'｢', u'｣', u'ｰ'
+)
+
+DIGIT_ZENKAKU_CHARS = (
+    u'０', u'１', u'２', u'３', u'４', u'５', u'６', u'７', u'８', u'９'
+)
+
+DIGIT_HANKAKU_CHARS = (
+    u'0', u'1', u'2', u'3', u'4', u'5', u'6', u'7', u'8', u'9'
+)
+
+KANA_TEN_MAP = (
+    (u'ガ', u'ｶ'), (u'ギ', u'ｷ'), (u'グ', u'ｸ'), (u'ゲ', u'ｹ'), (u'ゴ', u'ｺ'),
+    (u'ザ', u'ｻ'), (u'ジ', u'ｼ'), (u'ズ', u'ｽ'), (u'ゼ', u'ｾ'), (u'ゾ', u'ｿ'),
+    (u'ダ', u'ﾀ'), (u'ヂ', u'ﾁ'), (u'ヅ', u'ﾂ'), (u'デ', u'ﾃ'), (u'ド', u'ﾄ'),
+    (u'バ', u'ﾊ'), (u'ビ', u'ﾋ'), (u'ブ', u'ﾌ'), (u'ベ', u'ﾍ'), (u'ボ', u'ﾎ'),
+    (u'ヴ', u'ｳ')
+)
+
+KANA_MARU_MAP = (
+    (u'パ', u'ﾊ'), (u'ピ', u'ﾋ'), (u'プ', u'ﾌ'), (u'ペ', u'ﾍ'), (u'ポ', u'ﾎ')
+)
+
+
+_tables = None
+
+
+def _loadTables():
+    # built once, on the first conversion
+    global _tables
+    if _tables is not None:
+        return _tables
+
+    ascii_zh_table = {}
+    ascii_hz_table = {}
+    kana_zh_table = {}
+    kana_hz_table = {}
+    digit_zh_table = {}
+    digit_hz_table = {}
+
+    for (az, ah) in zip(ASCII_ZENKAKU_CHARS, ASCII_HANKAKU_CHARS):
+        ascii_zh_table[az] = ah
+        ascii_hz_table[ah] = az
+
+    for (kz, kh) in zip(KANA_ZENKAKU_CHARS, KANA_HANKAKU_CHARS):
+        kana_zh_table[kz] = kh
+        kana_hz_table[kh] = kz
+
+    for (dz, dh) in zip(DIGIT_ZENKAKU_CHARS, DIGIT_HANKAKU_CHARS):
+        digit_zh_table[dz] = dh
+        digit_hz_table[dh] = dz
+
+    kana_ten_zh_table = {}
+    kana_ten_hz_table = {}
+    kana_maru_zh_table = {}
+    kana_maru_hz_table = {}
+
+    for (ktz, kth) in KANA_TEN_MAP:
+        kana_ten_zh_table[ktz] = kth
+        kana_ten_hz_table[kth] = ktz
+
+    for (kmz, kmh) in KANA_MARU_MAP:
+        kana_maru_zh_table[kmz] = kmh
+        kana_maru_hz_table[kmh] = kmz
+
+    kakko_zh_table = {
+        u'｟': u'⦅', u'｠': u'⦆',
+        u'『': u'｢', u'』': u'｣',
+        u'〚': u'⟦', u'〛': u'⟧',
+        u'〔': u'❲', u'〕': u'❳',
+        u'〘': u'⟬', u'〙': u'⟭',
+        u'《': u'⟪', u'》': u'⟫',
+        u'【': u'(', u'】': u')',
+        u'〖': u'(', u'〗': u')'
+    }
+
+    kakko_hz_table = {}
+    for k, v in kakko_zh_table.items():
+        kakko_hz_table[v] = k
+
+    _tables = {
+        "ascii_zh": ascii_zh_table,
+        "ascii_hz": ascii_hz_table,
+        "kana_zh": kana_zh_table,
+        "kana_hz": kana_hz_table,
+        "digit_zh": digit_zh_table,
+        "digit_hz": digit_hz_table,
+        "kana_ten_zh": kana_ten_zh_table,
+        "kana_ten_hz": kana_ten_hz_table,
+        "kana_maru_zh": kana_maru_zh_table,
+        "kana_maru_hz": kana_maru_hz_table,
+        "kakko_zh": kakko_zh_table,
+        "kakko_hz": kakko_hz_table,
+    }
+    return _tables
+
+
+# translate() tables and the dakuten regex per (direction, flags, ignore),
+# built on first use
+_translations = {}
+
+# joins the texts of a bulk conversion; nothing converts to or from it
+_SEPARATOR = u'\0'
+
+
+def _translation(direction, ascii_, digit, kana, kakko, ignore):
+    # ignore is anything "c in ignore" works on: a string, tuple, set...
+    try:
+        key = (direction, ascii_, digit, kana, kakko, frozenset(ignore))
+    except TypeError:
+        key = None
+    if key in _translations:
+        return _translations[key]
+
+    tables = _loadTables()
+    table = {}
+    compose = {}
+    if direction == "zh":
+        # same order of precedence as the old character loop; plain kana
+        # stays zenkaku, only voiced ones are split up
+        parts = [(ascii_, tables["ascii_zh"], u''), (digit, tables["digit_zh"], u''),
+                 (kana, tables["kana_ten_zh"], u'ﾞ'), (kana, tables["kana_maru_zh"], u'ﾟ'),
+                 (kakko, tables["kakko_zh"], u'')]
+        for enabled, part, mark in parts:
+            if enabled:
+                for k, v in part.items():
+                    table.setdefault(ord(k), v + mark)
+    else:
+        for enabled, part in ((ascii_, tables["ascii_hz"]), (digit, tables["digit_hz"]),
+                              (kana, tables["kana_hz"]), (kakko, tables["kakko_hz"])):
+            if enabled:
+                for k, v in part.items():
+                    table.setdefault(ord(k), v)
+        if kana:
+            # a kana followed by its mark becomes one voiced character
+            for mark, part in ((u'ﾞ', tables["kana_ten_hz"]), (u'ﾟ', tables["kana_maru_hz"])):
+                for k, v in part.items():
+                    if k not in ignore:
+                        compose[k + mark] = v
+    for c in ignore:
+        if len(c) == 1:
+            table.pop(ord(c), None)
+    if direction == "hz":
+        # marks left over are dropped, ignored or not
+        table[ord(u'ﾞ')] = None
+        table[ord(u'ﾟ')] = None
+
+    regex = None
+    if compose:
+        regex = re.compile("|".join(re.escape(k) for k in sorted(compose)))
+    translation = (table, regex, compose)
+    if key is not None:
+        _translations[key] = translation
+    return translation
+
+
+def _convert(translation, text):
+    table, regex, compose = translation
+    if regex is not None:
+        text = regex.sub(lambda m: compose[m.group(0)], text)
+    return text.translate(table)
+
+
+def _convertAll(translation, texts):
+    # one translate() over all the texts joined, unless one of them holds
+    # the separator itself
+    texts = list(texts)
+    joined = _SEPARATOR.join(texts)
+    if joined.count(_SEPARATOR) != max(len(texts) - 1, 0):
+        return [_convert(translation, text) for text in texts]
+    if not texts:
+        return []
+    return _convert(translation, joined).split(_SEPARATOR)
+
+
+class MOJI:
+    @staticmethod
+    def zen2han(text="", ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+        return _convert(_translation("zh", ascii_, digit, kana, kakko, ignore), text)
+
+    @staticmethod
+    def han2zen(text, ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+        return _convert(_translation("hz", ascii_, digit, kana, kakko, ignore), text)
+
+    @staticmethod
+    def zen2han_all(texts, ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+        # zen2han() of every text, for whole lists of file names at once
+        return _convertAll(_translation("zh", ascii_, digit, kana, kakko, ignore), texts)
+
+    @staticmethod
+    def han2zen_all(texts, ascii_=True, digit=True, kana=True, kakko=True, ignore=()):
+        return _convertAll(_translation("hz", ascii_, digit, kana, kakko, ignore), texts)
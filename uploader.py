@@ -0,0 +1,3133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Author: Santosh Rai
+# Version: 1.00 (20200520)
+# upload engine shared by the GUI (index.py) and the command line:
+#   python uploader.py <folder> [-d gs://bucket/prefix] [-b gsutil|client|local] [-w 8] [--json]
+# keep the module level imports light, this is what cron pays on every run;
+# sqlite3, tarfile, mmap, uuid and the process pool are imported where they are used
+# needs Python 3.7 or newer
+
+import platform
+import os
+import io
+import sys
+import json
+import csv
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+import random
+import re
+import heapq
+import itertools
+import threading
+import collections
+import contextlib
+import functools
+import configparser
+import queue
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+OS = platform.system()
+
+# gsutil executable and number of transfers that run at the same time
+GSUTIL = "gsutil.cmd" if OS == "Windows" else "gsutil"
+UPLOAD_WORKERS = 8
+# files handed to one gsutil process in batched mode (1 = one process per file)
+UPLOAD_BATCH_SIZE = 200
+# files at least this big are sent in checkpointed chunks that a later run
+# can resume; chunks must be a multiple of 256 KiB for GCS
+RESUMABLE_THRESHOLD = 64 * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 16 * 1024 * 1024
+# files at least this big are split into slices uploaded in parallel and
+# composed into one object; GCS composes at most 32 components at once
+COMPOSITE_THRESHOLD = 256 * 1024 * 1024
+COMPOSITE_MIN_SLICE = 64 * 1024 * 1024
+COMPOSITE_MAX_SLICES = 32
+# with packing on, files smaller than PACK_MAX_FILE_SIZE travel inside tar
+# bundles of about PACK_BUNDLE_SIZE instead of one object each
+PACK_MAX_FILE_SIZE = 10 * 1024
+PACK_BUNDLE_SIZE = 64 * 1024 * 1024
+# with compression on, files are gzipped while they stream to the backend
+# when a deflated sample of their first COMPRESS_SAMPLE_SIZE bytes shrinks
+# to COMPRESS_MAX_RATIO or less
+COMPRESS_LEVEL = 6
+COMPRESS_MIN_SIZE = 4 * 1024
+COMPRESS_SAMPLE_SIZE = 64 * 1024
+COMPRESS_MAX_RATIO = 0.8
+COMPRESSED_EXTENSIONS = frozenset((
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp3", ".mp4", ".m4a", ".mov", ".avi", ".mkv",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".lzh",
+    ".pdf", ".docx", ".xlsx", ".pptx",
+))
+# ceiling for the adaptive concurrency controller
+UPLOAD_MAX_WORKERS = 32
+# extra tries for a failed file, RETRY_BASE_DELAY * 2 ** n apart (with
+# jitter) and never more than RETRY_MAX_DELAY
+UPLOAD_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# order in which queued transfers start, see scheduleOrder()
+SCHEDULE_STRATEGIES = ("fifo", "largest", "interleave")
+SCHEDULE_STRATEGY = "largest"
+# how transfers are driven, see uploadFiles()
+UPLOAD_ENGINES = ("threads", "asyncio")
+UPLOAD_ENGINE = "threads"
+# waves of uploadPipeline() in flight at once; the next wave's transfers
+# queue behind the current one's so the workers never wait at a boundary
+PIPELINE_WAVES = 2
+# threads listing folders at once for walkFilesParallel(), and how many
+# folder listings it may hold ahead of the caller
+SCAN_WORKERS = 16
+SCAN_PREFETCH = 256
+# exclude rules used when config.ini has none: OS and editor droppings and
+# version control folders
+SCAN_EXCLUDE = ("Thumbs.db", "desktop.ini", ".DS_Store", "~$*", "*.tmp", ".git/", ".svn/")
+# path components whose normalized form is remembered (see Name_Normalizer)
+NAME_CACHE_SIZE = 4096
+# full width characters left alone because their ASCII form means something
+# to object paths or to gsutil
+NAME_KEEP = u'／＊？［］'
+# processes used to hash files
+HASH_WORKERS = os.cpu_count() or 1
+# watch mode: seconds a file must stay unchanged before it is uploaded, and
+# seconds between scans when inotify is not available
+WATCH_SETTLE = 2.0
+WATCH_INTERVAL = 5.0
+
+# [upload] section of config.ini next to this script
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+DEFAULT_CONFIG = {
+    "backend": "gsutil",
+    "destination": "",
+    "workers": UPLOAD_WORKERS,
+    "batch_size": UPLOAD_BATCH_SIZE,
+    # skip files the sync manifest has already seen uploaded unchanged
+    "incremental": True,
+    "state_dir": os.path.join(os.path.expanduser("~"), ".gcp_upload"),
+    "hash_workers": HASH_WORKERS,
+    # folders listed at once; pays off on network mounts
+    "scan_workers": SCAN_WORKERS,
+    # files sorted by name and folders depth first, the same on every run
+    "scan_ordered": True,
+    # keep folder listings in state_dir/scan.db and only read folders whose
+    # mtime changed since the last run
+    "scan_index": False,
+    # gitignore style patterns separated by newlines or ';', see File_Filter
+    "exclude": "; ".join(SCAN_EXCLUDE),
+    "include": "",
+    # sizes as for parseSize, ages as for parseAge; blank = no limit
+    "min_size": "",
+    "max_size": "",
+    "min_age": "",
+    "max_age": "",
+    # send identical files once and server side copy the rest
+    "dedup": False,
+    "resumable_threshold": RESUMABLE_THRESHOLD,
+    "chunk_size": RESUMABLE_CHUNK_SIZE,
+    "composite_threshold": COMPOSITE_THRESHOLD,
+    "composite_slices": COMPOSITE_MAX_SLICES,
+    "pack": False,
+    "pack_max_file_size": PACK_MAX_FILE_SIZE,
+    "pack_bundle_size": PACK_BUNDLE_SIZE,
+    "compress": False,
+    # object names with full width letters, digits and brackets made half
+    # width, see Name_Normalizer
+    "normalize_names": False,
+    # "HH:MM-HH:MM bytes/s requests/s; ...", see parseSchedule()
+    "bandwidth_schedule": "",
+    "schedule": SCHEDULE_STRATEGY,
+    # let the AIMD controller move concurrency between 1 and max_workers
+    "adaptive": True,
+    "max_workers": UPLOAD_MAX_WORKERS,
+    "retries": UPLOAD_RETRIES,
+    # "threads" or "asyncio" (aioupload.py, gsutil processes on one event loop)
+    "engine": UPLOAD_ENGINE,
+    "watch_settle": WATCH_SETTLE,
+    "watch_interval": WATCH_INTERVAL,
+}
+
+
+File_Entry = collections.namedtuple("File_Entry", "path size mtime ctime")
+
+def parseRules(text):
+    # config.ini rule list: one pattern per line or separated by ';', '#'
+    # starts a comment line
+    rules = []
+    for line in text.replace(";", "\n").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            rules.append(line)
+    return rules
+
+def _globRegex(pattern):
+    # regex for one gitignore pattern, "!" and a trailing '/' already taken
+    # off. '*' and '?' stop at '/', "**" crosses it; a pattern with a '/' is
+    # matched from the top folder, one without against names at any depth
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            # zero or more folders
+            regex.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1:end]
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            regex.append("[" + chars.replace("\\", "\\\\") + "]")
+            i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(regex)
+
+class _Rule_Set(object):
+    # gitignore rules compiled into one regex for folders and one for files.
+    # Rules go in last first with a group each, so the group that matched is
+    # the last rule that applies. match() is True for a plain rule, False
+    # for a "!" rule and None when no rule matches
+
+    def __init__(self, rules):
+        folders = []
+        files = []
+        for rule in reversed(rules):
+            negate = rule.startswith("!")
+            if negate:
+                rule = rule[1:]
+            dirOnly = rule.endswith("/")
+            rule = rule.rstrip("/")
+            if not rule:
+                continue
+            folders.append((_globRegex(rule), negate))
+            if not dirOnly:
+                files.append((_globRegex(rule), negate))
+        self.folders = self._compile(folders)
+        self.files = self._compile(files)
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None, None
+        flags = re.DOTALL | (re.IGNORECASE if OS == "Windows" else 0)
+        regex = re.compile("|".join("(%s)" % rule for rule, negate in rules), flags)
+        return regex, [None] + [negate for rule, negate in rules]
+
+    def match(self, relPath, isDir=False):
+        regex, negated = self.folders if isDir else self.files
+        if regex is None:
+            return None
+        m = regex.fullmatch(relPath)
+        if m is None:
+            return None
+        return not negated[m.lastindex]
+
+
+class File_Filter(object):
+    # what a scan leaves out, compiled once per run: gitignore style exclude
+    # rules (the last matching rule wins, "!" takes a file or folder back, a
+    # rule ending in '/' only matches folders), include rules a file has to
+    # match when there are any, and size and age limits (0 = none). Paths
+    # are relative to the folder being uploaded, with '/' separators.
+    # Excluded folders are never listed, so nothing under them comes back.
+
+    def __init__(self, exclude=(), include=(), minSize=0, maxSize=0, minAge=0, maxAge=0):
+        self.exclude = _Rule_Set(exclude)
+        self.include = _Rule_Set(include) if include else None
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.minAge = minAge
+        self.maxAge = maxAge
+        self.setClock(time.time())
+
+    def setClock(self, now):
+        # ages are counted back from now
+        self.newest = now - self.minAge if self.minAge else None
+        self.oldest = now - self.maxAge if self.maxAge else None
+
+    def skipFolder(self, relPath):
+        return self.exclude.match(relPath, True) is True
+
+    def skipFile(self, relPath, size, mtime):
+        if self.exclude.match(relPath) is True:
+            return True
+        if self.include is not None and self.include.match(relPath) is not True:
+            return True
+        if size < self.minSize or (self.maxSize and size > self.maxSize):
+            return True
+        if self.newest is not None and mtime > self.newest:
+            return True
+        return self.oldest is not None and mtime < self.oldest
+
+    def excludes(self, relPath, size, mtime):
+        # skipFile() for a path that did not come from a scan (watch mode),
+        # so the folders it is in are checked as well
+        parts = relPath.split("/")
+        for k in range(1, len(parts)):
+            if self.skipFolder("/".join(parts[:k])):
+                return True
+        return self.skipFile(relPath, size, mtime)
+
+def getFilter(config):
+    # the File_Filter of config, None when it has nothing to leave out
+    exclude = parseRules(config["exclude"])
+    include = parseRules(config["include"])
+    limits = [parseSize(config["min_size"]), parseSize(config["max_size"]),
+              parseAge(config["min_age"]), parseAge(config["max_age"])]
+    if not exclude and not include and not any(limits):
+        return None
+    return File_Filter(exclude, include, *limits)
+
+def walkFiles(dirName, followLinks=True, counts=None, fileFilter=None):
+    # depth first generator of a File_Entry per regular file under dirName,
+    # yielded as soon as it is found. Only one scandir iterator per level is
+    # open, so memory follows the depth of the tree, not the number of files.
+    # Directory links are followed unless they point back at a folder we are
+    # already inside. Raises OSError if dirName itself cannot be read;
+    # unreadable subfolders are reported and skipped. Files and folders a
+    # File_Filter rules out are "pruned": not yielded, not descended into.
+    # counts, if given, gets the "folders" found and "listed" so far (see
+    # estimateTotal) and the number of entries "pruned"
+    if counts is None:
+        counts = {}
+    counts["folders"], counts["listed"], counts["pruned"] = 1, 0, 0
+    st = os.stat(dirName)
+    ancestors = [(st.st_dev, st.st_ino)]
+    # paths are built as prefix + name, prefix ending in '/'
+    stack = [(dirName.replace('\\', '/').rstrip('/') + '/', os.scandir(dirName))]
+    # path[rootLen:] is the path the filter rules see
+    rootLen = len(stack[0][0])
+    try:
+        while stack:
+            prefix, entries = stack[-1]
+            try:
+                entry = next(entries)
+            except (StopIteration, OSError) as error:
+                if not isinstance(error, StopIteration):
+                    print(error)
+                entries.close()
+                stack.pop()
+                ancestors.pop()
+                counts["listed"] += 1
+                continue
+
+            path = prefix + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=followLinks):
+                    if fileFilter is not None and fileFilter.skipFolder(path[rootLen:]):
+                        counts["pruned"] += 1
+                        continue
+                    # one stat per folder; dirent inode numbers are 0 on Windows
+                    st = os.stat(path)
+                    key = (st.st_dev, st.st_ino)
+                    if key in ancestors:
+                        print("skipping %s: link back to a parent folder" % path)
+                        continue
+                    stack.append((path + '/', os.scandir(path)))
+                    ancestors.append(key)
+                    counts["folders"] += 1
+                elif entry.is_file():
+                    # sockets, FIFOs and broken links are not uploaded
+                    st = entry.stat()
+                    if fileFilter is not None and fileFilter.skipFile(path[rootLen:], st.st_size, st.st_mtime):
+                        counts["pruned"] += 1
+                        continue
+                    yield File_Entry(path, st.st_size, st.st_mtime, st.st_ctime)
+            except OSError as error:
+                print(error)
+    finally:
+        for prefix, entries in stack:
+            entries.close()
+
+def _listFolder(prefix, ancestors, followLinks, rootLen=0, fileFilter=None):
+    # one folder of walkFilesParallel(): its File_Entry files, the (prefix,
+    # ancestors) of its subfolders, links back to a parent left out, and the
+    # number of entries fileFilter pruned
+    files = []
+    folders = []
+    pruned = 0
+    entries = os.scandir(prefix)
+    try:
+        for entry in entries:
+            path = prefix + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=followLinks):
+                    if fileFilter is not None and fileFilter.skipFolder(path[rootLen:]):
+                        pruned += 1
+                        continue
+                    st = os.stat(path)
+                    key = (st.st_dev, st.st_ino)
+                    if key in ancestors:
+                        print("skipping %s: link back to a parent folder" % path)
+                        continue
+                    folders.append((path + '/', ancestors + (key,)))
+                elif entry.is_file():
+                    st = entry.stat()
+                    if fileFilter is not None and fileFilter.skipFile(path[rootLen:], st.st_size, st.st_mtime):
+                        pruned += 1
+                        continue
+                    files.append(File_Entry(path, st.st_size, st.st_mtime, st.st_ctime))
+            except OSError as error:
+                print(error)
+    finally:
+        entries.close()
+    return files, folders, pruned
+
+def walkFilesParallel(dirName, workers=SCAN_WORKERS, ordered=False, followLinks=True, prefetch=SCAN_PREFETCH,
+                      counts=None, fileFilter=None):
+    # walkFiles() for slow (network) file systems: folders are listed on a
+    # pool of `workers` threads, each one as soon as its parent has been
+    # read. At most `prefetch` listings are held at a time; folders found
+    # beyond that wait as bare paths. Files of one folder come out together.
+    # ordered=False yields folders as their listings finish; ordered=True
+    # gives the same order on every run: a folder's files sorted by name,
+    # then its subfolders in name order, depth first. counts and fileFilter
+    # as for walkFiles
+    if counts is None:
+        counts = {}
+    counts["folders"], counts["listed"], counts["pruned"] = 1, 0, 0
+    st = os.stat(dirName)
+    root = (dirName.replace('\\', '/').rstrip('/') + '/', ((st.st_dev, st.st_ino),))
+    rootLen = len(root[0])
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    lock = threading.Lock()
+    # prefix -> future for listings submitted and not consumed yet
+    futures = {}
+    # prefix -> folder, found while over the prefetch budget
+    waiting = collections.OrderedDict()
+    finished = queue.Queue()
+    closed = [False]
+
+    def submit(folder):
+        # with lock held
+        futures[folder[0]] = executor.submit(listed, folder)
+
+    def listed(folder):
+        # on a pool thread: list folder, then queue its subfolders so they
+        # are read ahead of the consumer
+        try:
+            listing = _listFolder(folder[0], folder[1], followLinks, rootLen, fileFilter)
+            with lock:
+                if not closed[0]:
+                    for child in listing[1]:
+                        if len(futures) < prefetch:
+                            submit(child)
+                        else:
+                            waiting[child[0]] = child
+            return listing
+        finally:
+            if not ordered:
+                finished.put(folder[0])
+
+    def need(folder):
+        # with lock held: submit folder now, budget or not
+        if folder[0] not in futures:
+            waiting.pop(folder[0], None)
+            submit(folder)
+
+    def take(folder):
+        # the listing of folder, waiting for it if need be
+        with lock:
+            need(folder)
+            future = futures[folder[0]]
+        try:
+            files, folders, pruned = future.result()
+        except OSError as error:
+            print(error)
+            files, folders, pruned = [], [], 0
+        with lock:
+            del futures[folder[0]]
+            while waiting and len(futures) < prefetch:
+                submit(waiting.popitem(last=False)[1])
+        counts["folders"] += len(folders)
+        counts["listed"] += 1
+        counts["pruned"] += pruned
+        return files, folders
+
+    try:
+        with lock:
+            submit(root)
+        if ordered:
+            stack = [root]
+            while stack:
+                files, folders = take(stack.pop())
+                for entry in sorted(files):
+                    yield entry
+                stack.extend(sorted(folders, reverse=True))
+                # the read-ahead goes breadth first; make sure the folders
+                # this loop is about to visit are on their way too
+                with lock:
+                    for folder in stack[-workers:]:
+                        need(folder)
+        else:
+            # folders found and not consumed yet, the root included; every
+            # one of them is submitted eventually and comes through finished
+            remaining = 1
+            while remaining:
+                files, folders = take((finished.get(), None))
+                remaining += len(folders) - 1
+                for entry in files:
+                    yield entry
+    finally:
+        with lock:
+            closed[0] = True
+        executor.shutdown(wait=False)
+
+class Scan_Index(object):
+    """Folder listings keyed by absolute path and folder mtime, so unchanged folders are not read again"""
+
+    # a listing taken within RACY seconds of the folder's last change is not
+    # trusted: another change in the same mtime tick would go unnoticed
+    RACY = 2.0
+    # listings stored between commits, so an interrupted scan keeps most of
+    # what it read
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        import sqlite3
+        self._db = sqlite3.connect(path)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS folders (
+            path TEXT NOT NULL PRIMARY KEY,
+            mtime INTEGER NOT NULL,
+            listed REAL NOT NULL,
+            seen REAL NOT NULL)""")
+        # size, mtime and ctime are NULL for a subfolder
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            ctime REAL,
+            PRIMARY KEY (folder, name)) WITHOUT ROWID""")
+        self._stored = 0
+
+    @staticmethod
+    def _under(folder):
+        # key range of folder (ending in '/') and everything below it;
+        # '0' is the character after '/'
+        return folder, folder[:-1] + '0'
+
+    def listing(self, folder, mtime):
+        # (files, folders) as _readFolder() returns them when folder still
+        # has the mtime (in ns) it had when it was stored, None otherwise
+        row = self._db.execute("SELECT mtime, listed FROM folders WHERE path = ?", (folder,)).fetchone()
+        if row is None or row[0] != mtime or row[1] - mtime / 1e9 < self.RACY:
+            return None
+        self._db.execute("UPDATE folders SET seen = ? WHERE path = ?", (time.time(), folder))
+        files = []
+        folders = []
+        for name, size, fileMtime, ctime in self._db.execute(
+                "SELECT name, size, mtime, ctime FROM entries WHERE folder = ? ORDER BY name", (folder,)):
+            if size is None:
+                folders.append(name)
+            else:
+                files.append((name, size, fileMtime, ctime))
+        return files, folders
+
+    def store(self, folder, mtime, listedAt, files, folders):
+        # replaces what the index has for folder; subfolders that are gone
+        # are forgotten along with everything under them
+        for (name,) in self._db.execute("SELECT name FROM entries WHERE folder = ? AND size IS NULL",
+                                        (folder,)).fetchall():
+            if name not in folders:
+                self.forget(folder + name + '/')
+        self._db.execute("DELETE FROM entries WHERE folder = ?", (folder,))
+        self._db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                             [(folder,) + tuple(entry) for entry in files] +
+                             [(folder, name, None, None, None) for name in folders])
+        self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)", (folder, mtime, listedAt, listedAt))
+        self._stored += 1
+        if self._stored % self.COMMIT_EVERY == 0:
+            self._db.commit()
+
+    def forget(self, folder):
+        self._db.execute("DELETE FROM entries WHERE folder >= ? AND folder < ?", self._under(folder))
+        self._db.execute("DELETE FROM folders WHERE path >= ? AND path < ?", self._under(folder))
+
+    def compact(self, folder, before):
+        # drops the folders under folder that no scan has reached since
+        # before (deleted, excluded or moved away) and gives the space back;
+        # returns the number of folders dropped
+        stale = self._db.execute("SELECT path FROM folders WHERE path >= ? AND path < ? AND seen < ?",
+                                 self._under(folder) + (before,)).fetchall()
+        for (path,) in stale:
+            self._db.execute("DELETE FROM entries WHERE folder = ?", (path,))
+            self._db.execute("DELETE FROM folders WHERE path = ?", (path,))
+        self._db.commit()
+        self._db.execute("VACUUM")
+        return len(stale)
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+def _indexKey(dirName):
+    # Scan_Index key of a folder: absolute, '/' separated, ending in '/'
+    return os.path.abspath(dirName).replace('\\', '/').rstrip('/') + '/'
+
+def _readFolder(prefix, followLinks):
+    # full listing of one folder for the Scan_Index: its files as (name,
+    # size, mtime, ctime) and its subfolder names, both sorted by name
+    files = []
+    folders = []
+    entries = os.scandir(prefix)
+    try:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=followLinks):
+                    folders.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files.append((entry.name, st.st_size, st.st_mtime, st.st_ctime))
+            except OSError as error:
+                print(error)
+    finally:
+        entries.close()
+    files.sort()
+    folders.sort()
+    return files, folders
+
+def walkFilesIndexed(dirName, index, followLinks=True, counts=None, fileFilter=None):
+    # walkFiles() through a Scan_Index: a folder whose mtime has not changed
+    # since the index last listed it is not read again, its files come from
+    # the index with the size and times they had then (a file rewritten in
+    # place does not touch its folder's mtime; the sync manifest stats every
+    # file anyway). Other folders are read and stored. The only call per
+    # unchanged folder is one stat. Files come out by name, subfolders depth
+    # first in name order. counts and fileFilter as for walkFiles; counts
+    # also gets the folders taken from the index as "cached"
+    if counts is None:
+        counts = {}
+    counts["folders"], counts["listed"], counts["pruned"], counts["cached"] = 1, 0, 0, 0
+    prefix = dirName.replace('\\', '/').rstrip('/') + '/'
+    rootLen = len(prefix)
+    keyRoot = _indexKey(dirName)
+    stack = [(prefix, os.stat(dirName), ())]
+    try:
+        while stack:
+            prefix, st, ancestors = stack.pop()
+            ancestors += ((st.st_dev, st.st_ino),)
+            key = keyRoot + prefix[rootLen:]
+            counts["listed"] += 1
+            listing = index.listing(key, st.st_mtime_ns)
+            if listing is None:
+                listedAt = time.time()
+                try:
+                    listing = _readFolder(prefix, followLinks)
+                except OSError as error:
+                    print(error)
+                    continue
+                index.store(key, st.st_mtime_ns, listedAt, *listing)
+            else:
+                counts["cached"] += 1
+
+            files, folders = listing
+            for name, size, mtime, ctime in files:
+                path = prefix + name
+                if fileFilter is not None and fileFilter.skipFile(path[rootLen:], size, mtime):
+                    counts["pruned"] += 1
+                    continue
+                yield File_Entry(path, size, mtime, ctime)
+
+            children = []
+            for name in folders:
+                path = prefix + name
+                if fileFilter is not None and fileFilter.skipFolder(path[rootLen:]):
+                    counts["pruned"] += 1
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError as error:
+                    print(error)
+                    continue
+                if (st.st_dev, st.st_ino) in ancestors:
+                    print("skipping %s: link back to a parent folder" % path)
+                    continue
+                children.append((path + '/', st, ancestors))
+            counts["folders"] += len(children)
+            stack.extend(reversed(children))
+    finally:
+        index.commit()
+
+def getListOfFiles(dirName, workers=1, ordered=False, fileFilter=None):
+    # every file under dirName, for callers that need the whole list up
+    # front; workers > 1 lists folders in parallel. Raises OSError for a
+    # missing folder
+    if workers > 1:
+        return [entry.path for entry in walkFilesParallel(dirName, workers, ordered, fileFilter=fileFilter)]
+    return [entry.path for entry in walkFiles(dirName, fileFilter=fileFilter)]
+
+
+def objectName(dirName, path):
+    # "gsutil cp -r <folder>" semantics: the selected folder itself becomes
+    # the top level prefix under the destination
+    relPath = os.path.relpath(path, os.path.dirname(dirName.rstrip('/\\')))
+    return relPath.replace('\\', '/')
+
+
+class Name_Normalizer(object):
+    """Object names made of NFC, half width path components, memoized per folder"""
+
+    def __init__(self, cacheSize=NAME_CACHE_SIZE):
+        import unicodedata
+        from moji import MOJI
+        self._nfc = functools.partial(unicodedata.normalize, "NFC")
+        self._zen2han = MOJI.zen2han
+        # folder names repeat for every file under them; file names rarely
+        # do and would only push folders out of the cache
+        self.folder = functools.lru_cache(maxsize=cacheSize)(self._folder)
+        self.component = functools.lru_cache(maxsize=cacheSize)(self._component)
+        # normalized name -> local path, for names that changed; both are
+        # per run, see reset()
+        self.claimed = {}
+        # files already reported as keeping their name
+        self.kept = set()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        # forget the names of the previous run (or watch batch) so a long
+        # running process does not hold every path it ever uploaded
+        with self._lock:
+            self.claimed.clear()
+            self.kept.clear()
+
+    def _component(self, part):
+        # kana are left alone: zen2han only splits the voiced ones, which
+        # would leave names half converted. '／' would become a separator
+        # and '＊？［］' gsutil wildcards. A part that would become '.' or
+        # '..' ('．．') is left as it is: it would climb out of the
+        # destination of the local backend
+        normal = self._zen2han(self._nfc(part), kana=False, ignore=NAME_KEEP)
+        if normal in (".", ".."):
+            return part
+        return normal
+
+    def _folder(self, folder):
+        return "/".join(self.component(part) for part in folder.split("/"))
+
+    def name(self, dirName, path, name):
+        # the normalized form of name, the object name of path. Two files
+        # must not end up as one object: when the normalized name belongs to
+        # another file of the run, or to a file already called that, the
+        # name is kept as it is
+        folder, slash, base = name.rpartition("/")
+        normal = self.folder(folder) + slash + self._component(base)
+        if normal == name:
+            return name
+        with self._lock:
+            owner = self.claimed.setdefault(normal, path)
+        other = os.path.join(os.path.dirname(dirName.rstrip('/\\')), normal)
+        if owner == path and os.path.lexists(other):
+            try:
+                # a case or Unicode form insensitive file system
+                if not os.path.samefile(other, path):
+                    owner = other
+            except OSError:
+                owner = other
+        if owner != path:
+            if path not in self.kept:
+                self.kept.add(path)
+                print("%s: %s is already taken by %s, name kept" % (path, normal, owner))
+            return name
+        return normal
+
+
+class Transport(object):
+    """Base class for upload backends"""
+
+    # backends that implement the startResumable/uploadChunk/finishResumable
+    # methods set this; large files are then sent in checkpointed chunks
+    resumable = False
+    # backends that implement uploadSlice/compose/delete set this; very large
+    # files are then sent as parallel slices composed into one object
+    composite = False
+
+    def __init__(self, destination, workers=UPLOAD_WORKERS):
+        self.destination = destination.rstrip('/')
+        self.workers = workers
+        # set by getTransport() from config.ini
+        self.checkpointDir = None
+        self.chunkSize = RESUMABLE_CHUNK_SIZE
+        self.resumableThreshold = RESUMABLE_THRESHOLD
+        self.compositeThreshold = COMPOSITE_THRESHOLD
+        self.compositeSlices = COMPOSITE_MAX_SLICES
+        self.compress = False
+        # Rate_Limiter shared by every worker, None for no limits
+        self.limiter = None
+        # per-file figures of the current run keyed by local path, for the CSV
+        self.stats = {}
+        # Name_Normalizer for object names, None to keep local names
+        self.normalizer = None
+
+    def objectName(self, dirName, path):
+        name = objectName(dirName, path)
+        if self.normalizer is not None:
+            return self.normalizer.name(dirName, path, name)
+        return name
+
+    def upload(self, path, name):
+        # returns "OK" or "NG" for one file
+        raise NotImplementedError
+
+    def uploadBatch(self, items):
+        # items is a list of (path, name); backends that can move several
+        # files with one call override this
+        return [self.upload(path, name) for path, name in items]
+
+    def uploadStream(self, stream, name, contentEncoding=None, contentType=None):
+        # uploads everything read() returns from stream; "OK" or "NG". A
+        # stream has no file name to guess the type from, so callers pass it
+        raise NotImplementedError
+
+    def copy(self, name, newName):
+        # server side copy of an object already uploaded; "OK" or "NG"
+        raise NotImplementedError
+
+    def startResumable(self, name, size):
+        # returns a JSON-serializable session for the chunk methods below
+        raise NotImplementedError
+
+    def resumableOffset(self, session, size):
+        # bytes the backend has confirmed for session, None if it has expired
+        raise NotImplementedError
+
+    def uploadChunk(self, session, data, offset, size):
+        # writes data at offset and returns the new confirmed offset
+        raise NotImplementedError
+
+    def finishResumable(self, session, name):
+        pass
+
+    def uploadSlice(self, path, offset, length, name):
+        # uploads bytes [offset, offset + length) of path as object name;
+        # raises on failure
+        raise NotImplementedError
+
+    def compose(self, names, name, contentType=None):
+        raise NotImplementedError
+
+    def delete(self, names):
+        raise NotImplementedError
+
+    def exists(self, names):
+        # the names in names that are stored objects
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Gsutil_Transport(Transport):
+    """gsutil command line"""
+
+    composite = True
+
+    def _url(self, name):
+        return "%s/%s" % (self.destination, name)
+
+    def uploadStream(self, stream, name, contentEncoding=None, contentType=None):
+        command = [GSUTIL]
+        if contentEncoding:
+            command += ["-h", "Content-Encoding:%s" % contentEncoding]
+        if contentType:
+            command += ["-h", "Content-Type:%s" % contentType]
+        process = subprocess.Popen(command + ["cp", "-", self._url(name)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+                process.stdin.write(block)
+        except (IOError, OSError) as error:
+            print(error)
+            process.kill()
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            print(output)
+            return "NG"
+        return "OK"
+
+    def uploadSlice(self, path, offset, length, name):
+        # "cp -" uploads whatever arrives on stdin
+        process = subprocess.Popen([GSUTIL, "cp", "-", self._url(name)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    data = f.read(min(remaining, HASH_BLOCK_SIZE))
+                    if not data:
+                        raise IOError("%s shrank during upload" % path)
+                    process.stdin.write(data)
+                    remaining -= len(data)
+        finally:
+            output = process.communicate()[0]
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, "gsutil cp -", output)
+
+    def compose(self, names, name, contentType=None):
+        subprocess.check_output([GSUTIL, "compose"] + [self._url(n) for n in names] + [self._url(name)],
+                                stderr=subprocess.STDOUT)
+        if contentType:
+            # the slices went up through stdin, without a type of their own
+            subprocess.check_output([GSUTIL, "setmeta", "-h", "Content-Type:%s" % contentType, self._url(name)],
+                                    stderr=subprocess.STDOUT)
+
+    def delete(self, names):
+        subprocess.check_output([GSUTIL, "-m", "rm"] + [self._url(n) for n in names],
+                                stderr=subprocess.STDOUT)
+
+    def exists(self, names):
+        # ls prints the URLs it found and fails for the rest
+        urls = dict((self._url(n), n) for n in names)
+        process = subprocess.Popen([GSUTIL, "ls"] + list(urls), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = process.communicate()[0].decode('utf-8', 'replace')
+        return [urls[line.strip()] for line in output.splitlines() if line.strip() in urls]
+
+    def upload(self, path, name):
+        try:
+            subprocess.check_output([GSUTIL, "cp", path, "%s/%s" % (self.destination, name)],
+                                    stderr=subprocess.STDOUT)
+            return "OK"
+        except (subprocess.CalledProcessError, OSError) as error:
+            print(error)
+            return "NG"
+
+    def copy(self, name, newName):
+        try:
+            subprocess.check_output([GSUTIL, "cp", "%s/%s" % (self.destination, name),
+                                     "%s/%s" % (self.destination, newName)], stderr=subprocess.STDOUT)
+            return "OK"
+        except (subprocess.CalledProcessError, OSError) as error:
+            print(error)
+            return "NG"
+
+    def uploadBatch(self, items):
+        # one "gsutil -m cp -I" process per destination folder: file names go
+        # in on stdin and the per-file outcome is read back from the -L log.
+        # cp -I keeps local file names, so renamed files go one by one
+        folders = {}
+        outcome = {}
+        for path, name in items:
+            if os.path.basename(name) != os.path.basename(path):
+                outcome[path] = "OK" if self.upload(path, name) == "OK" else "NG"
+            else:
+                folders.setdefault(os.path.dirname(name), []).append(path)
+
+        for folder, paths in folders.items():
+            outcome.update(self._copyFolder(paths, "%s/%s/" % (self.destination, folder)))
+
+        # files missing from the log never got a result, so they failed too
+        return ["OK" if outcome.get(path) == "OK" else "NG" for path, name in items]
+
+    def _copyFolder(self, paths, destination):
+        fd, logPath = tempfile.mkstemp(prefix="gsutil_", suffix=".csv")
+        os.close(fd)
+        try:
+            manifest = "\n".join(paths) + "\n"
+            try:
+                process = subprocess.Popen([GSUTIL, "-m", "cp", "-I", "-L", logPath, destination],
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                output = process.communicate(manifest.encode('utf-8'))[0]
+            except OSError as error:
+                print(error)
+                return {}
+
+            if process.returncode != 0:
+                # some or all files failed; the log still has the ones that made it
+                print("gsutil cp -I to %s exited with %d:" % (destination, process.returncode))
+                print(output.decode('utf-8', 'replace').rstrip())
+            return self._parseLog(logPath)
+        finally:
+            os.remove(logPath)
+
+    @staticmethod
+    def _parseLog(logPath):
+        # gsutil -L writes: Source,Destination,Start,End,Md5,UploadId,Source Size,
+        # Bytes Transferred,Result,Description
+        outcome = {}
+        with io.open(logPath, 'r', encoding='utf-8') as logfile:
+            for row in csv.DictReader(logfile):
+                source = row.get("Source") or ""
+                if source.startswith("file://"):
+                    source = source[len("file://"):]
+                outcome[source.replace('\\', '/')] = row.get("Result")
+        return outcome
+
+
+class Client_Transport(Transport):
+    """google-cloud-storage client, no process per file"""
+
+    def __init__(self, destination, workers=UPLOAD_WORKERS):
+        Transport.__init__(self, destination, workers)
+
+        try:
+            from google.cloud import storage
+            import requests
+        except ImportError:
+            raise ImportError("backend 'client' needs google-cloud-storage: pip install google-cloud-storage")
+
+        if not self.destination.startswith("gs://"):
+            raise ValueError("destination must be gs://bucket[/prefix]: %s" % destination)
+        bucketName, _, self.prefix = self.destination[len("gs://"):].partition('/')
+
+        self.client = storage.Client()
+        # one keep-alive connection per worker instead of requests' default 10
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(10, workers))
+        self.client._http.mount("https://", adapter)
+        self.bucket = self.client.bucket(bucketName)
+
+    resumable = True
+
+    def _blobName(self, name):
+        return "%s/%s" % (self.prefix, name) if self.prefix else name
+
+    def startResumable(self, name, size):
+        return self.bucket.blob(self._blobName(name)).create_resumable_upload_session(size=size)
+
+    def resumableOffset(self, session, size):
+        # an empty PUT asks the session how much it has persisted
+        response = self.client._http.put(session, headers={"Content-Range": "bytes */%d" % size})
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code != 308:
+            return None
+        confirmed = response.headers.get("Range")
+        return int(confirmed.rsplit('-', 1)[1]) + 1 if confirmed else 0
+
+    def uploadChunk(self, session, data, offset, size):
+        end = offset + len(data) - 1
+        response = self.client._http.put(session, data=bytes(data),
+                                         headers={"Content-Range": "bytes %d-%d/%d" % (offset, end, size)})
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code != 308:
+            raise IOError("chunk %d-%d failed: %s %s" % (offset, end, response.status_code, response.text))
+        confirmed = response.headers.get("Range")
+        return int(confirmed.rsplit('-', 1)[1]) + 1 if confirmed else 0
+
+    def upload(self, path, name):
+        try:
+            self.bucket.blob(self._blobName(name)).upload_from_filename(path)
+            return "OK"
+        except Exception as error:
+            print(error)
+            return "NG"
+
+    def copy(self, name, newName):
+        try:
+            self.bucket.copy_blob(self.bucket.blob(self._blobName(name)), self.bucket, self._blobName(newName))
+            return "OK"
+        except Exception as error:
+            print(error)
+            return "NG"
+
+    def uploadStream(self, stream, name, contentEncoding=None, contentType=None):
+        try:
+            blob = self.bucket.blob(self._blobName(name))
+            blob.content_encoding = contentEncoding
+            # a chunk size makes the client stream a body of unknown length
+            blob.chunk_size = self.chunkSize
+            blob.upload_from_file(stream, content_type=contentType)
+            return "OK"
+        except Exception as error:
+            print(error)
+            return "NG"
+
+    composite = True
+
+    def uploadSlice(self, path, offset, length, name):
+        # a resumable upload (slices are big enough for one) wants a stream
+        # that starts at position 0
+        with open(path, 'rb') as f:
+            self.bucket.blob(self._blobName(name)).upload_from_file(Slice_Reader(f, offset, length), size=length)
+
+    def compose(self, names, name, contentType=None):
+        blob = self.bucket.blob(self._blobName(name))
+        blob.content_type = contentType
+        blob.compose([self.bucket.blob(self._blobName(n)) for n in names])
+
+    def delete(self, names):
+        self.bucket.delete_blobs([self.bucket.blob(self._blobName(n)) for n in names])
+
+    def exists(self, names):
+        return [n for n in names if self.bucket.blob(self._blobName(n)).exists()]
+
+    def close(self):
+        self.client._http.close()
+
+
+class Local_Transport(Transport):
+    """local directory standing in for a bucket, for tests and benchmarks"""
+
+    def __init__(self, destination, workers=UPLOAD_WORKERS):
+        if destination.startswith("file://"):
+            destination = destination[len("file://"):]
+        Transport.__init__(self, destination, workers)
+
+    def _target(self, name):
+        return os.path.join(self.destination, *name.split('/'))
+
+    def _prepare(self, name):
+        target = self._target(name)
+        folder = os.path.dirname(target)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # another worker created it first
+                if not os.path.isdir(folder):
+                    raise
+        # written next to the target and renamed, like an object that
+        # only becomes visible once complete
+        return target, target + ".partial"
+
+    def upload(self, path, name):
+        try:
+            target, partial = self._prepare(name)
+            shutil.copyfile(path, partial)
+            os.replace(partial, target)
+            return "OK"
+        except (IOError, OSError) as error:
+            print(error)
+            return "NG"
+
+    resumable = True
+
+    def startResumable(self, name, size):
+        import uuid
+        target, partial = self._prepare(name)
+        # a partial file of its own per session so an old one never gets mixed in
+        session = "%s.%s" % (partial, uuid.uuid4().hex)
+        open(session, 'wb').close()
+        return session
+
+    def resumableOffset(self, session, size):
+        if not os.path.exists(session):
+            return None
+        return min(os.path.getsize(session), size)
+
+    def uploadChunk(self, session, data, offset, size):
+        with open(session, 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset + len(data)
+
+    def finishResumable(self, session, name):
+        os.replace(session, self._target(name))
+
+    composite = True
+
+    def uploadSlice(self, path, offset, length, name):
+        target, partial = self._prepare(name)
+        with open(path, 'rb') as src:
+            src.seek(offset)
+            with open(partial, 'wb') as dst:
+                remaining = length
+                while remaining > 0:
+                    data = src.read(min(remaining, HASH_BLOCK_SIZE))
+                    if not data:
+                        raise IOError("%s shrank during upload" % path)
+                    dst.write(data)
+                    remaining -= len(data)
+        os.replace(partial, target)
+
+    def compose(self, names, name, contentType=None):
+        target, partial = self._prepare(name)
+        with open(partial, 'wb') as dst:
+            for n in names:
+                with open(self._target(n), 'rb') as src:
+                    shutil.copyfileobj(src, dst, HASH_BLOCK_SIZE)
+        os.replace(partial, target)
+
+    def delete(self, names):
+        for n in names:
+            os.remove(self._target(n))
+
+    def exists(self, names):
+        return [n for n in names if os.path.isfile(self._target(n))]
+
+    def uploadStream(self, stream, name, contentEncoding=None, contentType=None):
+        # there is no metadata here: an encoded object simply stays encoded
+        try:
+            target, partial = self._prepare(name)
+            with open(partial, 'wb') as f:
+                shutil.copyfileobj(stream, f, HASH_BLOCK_SIZE)
+            os.replace(partial, target)
+            return "OK"
+        except (IOError, OSError) as error:
+            print(error)
+            return "NG"
+
+    def copy(self, name, newName):
+        try:
+            source = self._target(name)
+            target, partial = self._prepare(newName)
+            if os.path.exists(partial):
+                os.remove(partial)
+            try:
+                # a hard link is the local equivalent of a server side copy
+                os.link(source, partial)
+            except (AttributeError, OSError):
+                shutil.copyfile(source, partial)
+            os.replace(partial, target)
+            return "OK"
+        except (IOError, OSError) as error:
+            print(error)
+            return "NG"
+
+
+TRANSPORTS = {
+    "gsutil": Gsutil_Transport,
+    "client": Client_Transport,
+    "local": Local_Transport,
+}
+
+def getTransport(config):
+    backend = config["backend"]
+    if backend not in TRANSPORTS:
+        raise ValueError("unknown backend '%s', expected one of %s" % (backend, ", ".join(sorted(TRANSPORTS))))
+    transport = TRANSPORTS[backend](config["destination"], config["workers"])
+    transport.checkpointDir = os.path.join(config["state_dir"], "checkpoints")
+    transport.chunkSize = config["chunk_size"]
+    transport.resumableThreshold = config["resumable_threshold"]
+    transport.compositeThreshold = config["composite_threshold"]
+    transport.compositeSlices = min(config["composite_slices"], COMPOSITE_MAX_SLICES)
+    transport.compress = config["compress"]
+    transport.limiter = Rate_Limiter(parseSchedule(config["bandwidth_schedule"]))
+    if config["normalize_names"]:
+        transport.normalizer = Name_Normalizer()
+    return transport
+
+def _checkpointPath(transport, path, name, kind="resumable"):
+    key = "%s\n%s\n%s\n%s" % (kind, transport.destination, name, os.path.abspath(path))
+    return os.path.join(transport.checkpointDir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+
+def _saveCheckpoint(checkpointPath, checkpoint):
+    # replaced in one step so a crash never leaves half a checkpoint
+    partial = checkpointPath + ".partial"
+    with open(partial, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(partial, checkpointPath)
+
+def resumableUpload(transport, path, name):
+    # sends path in transport.chunkSize pieces, checkpointing the confirmed
+    # offset after each one; a later run for the same file, destination and
+    # unchanged content carries on from there instead of from zero
+    checkpointPath = _checkpointPath(transport, path, name)
+    try:
+        st = os.stat(path)
+        size = st.st_size
+
+        checkpoint = None
+        if os.path.exists(checkpointPath):
+            with open(checkpointPath) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("size") != size or checkpoint.get("mtime") != st.st_mtime:
+                checkpoint = None
+
+        offset = None
+        if checkpoint is not None:
+            offset = transport.resumableOffset(checkpoint["session"], size)
+        if offset is None:
+            checkpoint = {"path": path, "name": name, "size": size, "mtime": st.st_mtime,
+                          "session": transport.startResumable(name, size), "offset": 0}
+            offset = 0
+            folder = os.path.dirname(checkpointPath)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            _saveCheckpoint(checkpointPath, checkpoint)
+        elif offset > 0:
+            print("resuming %s at %d of %d bytes" % (path, offset, size))
+
+        with open(path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                data = f.read(transport.chunkSize)
+                if not data:
+                    raise IOError("%s shrank during upload" % path)
+                if transport.limiter is not None:
+                    transport.limiter.request()
+                    transport.limiter.transfer(len(data))
+                offset = transport.uploadChunk(checkpoint["session"], data, offset, size)
+                checkpoint["offset"] = offset
+                _saveCheckpoint(checkpointPath, checkpoint)
+
+        transport.finishResumable(checkpoint["session"], name)
+        os.remove(checkpointPath)
+        return "OK"
+    except Exception as error:
+        # the checkpoint stays behind for the next run
+        print(error)
+        return "NG"
+
+def planSlices(size, maxSlices=COMPOSITE_MAX_SLICES, minSlice=COMPOSITE_MIN_SLICE):
+    # [(offset, length)]: more slices as the file grows, never smaller than
+    # minSlice, and at most maxSlices so one compose call is enough
+    count = max(2, min(maxSlices, size // minSlice))
+    sliceSize = -(-size // count)
+    return [(offset, min(sliceSize, size - offset)) for offset in range(0, size, sliceSize)]
+
+def _sendSlice(transport, path, offset, length, name):
+    if transport.limiter is not None:
+        transport.limiter.request()
+        transport.limiter.transfer(length)
+    start = time.time()
+    transport.uploadSlice(path, offset, length, name)
+    return time.time() - start
+
+def compositeUpload(transport, path, name):
+    # slices of path go up concurrently as temporary component objects that
+    # are then composed into name; finished slices are checkpointed so a
+    # later run only sends the missing ones
+    import uuid
+    checkpointPath = _checkpointPath(transport, path, name, "composite")
+    try:
+        st = os.stat(path)
+        size = st.st_size
+
+        checkpoint = None
+        if os.path.exists(checkpointPath):
+            with open(checkpointPath) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("size") != size or checkpoint.get("mtime") != st.st_mtime:
+                checkpoint = None
+        if checkpoint is None:
+            checkpoint = {"path": path, "name": name, "size": size, "mtime": st.st_mtime,
+                          "prefix": "%s.composite-%s" % (name, uuid.uuid4().hex[:8]),
+                          "slices": planSlices(size, transport.compositeSlices), "done": []}
+            folder = os.path.dirname(checkpointPath)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            _saveCheckpoint(checkpointPath, checkpoint)
+
+        slices = checkpoint["slices"]
+        components = ["%s-%03d" % (checkpoint["prefix"], i) for i in range(len(slices))]
+        todo = [i for i in range(len(slices)) if i not in checkpoint["done"]]
+
+        failed = 0
+        sent = 0
+        start = time.time()
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(todo), transport.workers))) as executor:
+                futures = {}
+                for i in todo:
+                    offset, length = slices[i]
+                    futures[executor.submit(_sendSlice, transport, path, offset, length, components[i])] = i
+
+                for future in as_completed(futures):
+                    i = futures[future]
+                    length = slices[i][1]
+                    try:
+                        elapsed = future.result()
+                    except Exception as error:
+                        print("%s slice %d/%d failed: %s" % (name, i + 1, len(slices), error))
+                        failed += 1
+                        continue
+                    print("%s slice %d/%d: %.1f MB in %.2fs (%.1f MB/s)" % (
+                        name, i + 1, len(slices), length / 1048576.0, elapsed, length / 1048576.0 / max(elapsed, 1e-6)))
+                    sent += length
+                    checkpoint["done"].append(i)
+                    _saveCheckpoint(checkpointPath, checkpoint)
+
+        if failed:
+            return "NG"
+
+        try:
+            transport.compose(components, name, contentType(path))
+        except Exception as error:
+            print("%s: compose failed: %s" % (name, error))
+            # a component that has gone (a lifecycle rule, a manual clean up)
+            # would fail every later compose too, so its slice is sent again
+            try:
+                present = set(transport.exists(components))
+            except Exception as error:
+                print(error)
+                present = set()
+            checkpoint["done"] = [i for i in checkpoint["done"] if components[i] in present]
+            _saveCheckpoint(checkpointPath, checkpoint)
+            return "NG"
+        elapsed = time.time() - start
+        print("%s: %.1f MB in %d slices, %.2fs (%.1f MB/s aggregate)" % (
+            name, sent / 1048576.0, len(slices), elapsed, sent / 1048576.0 / max(elapsed, 1e-6)))
+
+        try:
+            transport.delete(components)
+        except Exception as error:
+            # the object is complete; leftovers only cost storage
+            print(error)
+        os.remove(checkpointPath)
+        return "OK"
+    except Exception as error:
+        print(error)
+        return "NG"
+
+class Token_Bucket(object):
+    """Thread-safe token bucket; a rate of 0 means unlimited"""
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.setRate(rate)
+
+    def setRate(self, rate):
+        with self._lock:
+            self.rate = rate
+            # up to one second worth of burst
+            self.capacity = rate
+            self._tokens = rate
+            self._last = time.time()
+
+    def acquire(self, n):
+        # blocks until n tokens were taken; amounts above the capacity are
+        # taken in capacity sized parts
+        while n > 0:
+            with self._lock:
+                if self.rate <= 0:
+                    return
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                take = min(n, self.capacity)
+                if self._tokens >= take:
+                    self._tokens -= take
+                    n -= take
+                    continue
+                wait = (take - self._tokens) / float(self.rate)
+            time.sleep(wait)
+
+
+def parseSize(text):
+    # "512", "64K", "1.5M", "2G" -> bytes
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text or 0))
+
+def parseAge(text):
+    # "90", "90s", "15m", "12h", "7d" -> seconds
+    text = text.strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text or 0)
+
+def parseSchedule(text):
+    # "09:00-18:00 1M 20; 18:00-09:00 0 0" -> [(start, end, bytes/s, requests/s)]
+    # with start and end in minutes after midnight; 0 means unlimited, a
+    # window may wrap past midnight and equal ends cover the whole day
+    schedule = []
+    for part in text.replace(",", ";").split(";"):
+        fields = part.split()
+        if not fields:
+            continue
+        if len(fields) != 3:
+            raise ValueError("bad bandwidth_schedule entry: %s" % part.strip())
+        start, end = fields[0].split("-")
+        minutes = [int(t.split(":")[0]) * 60 + int(t.split(":")[1]) for t in (start, end)]
+        schedule.append((minutes[0], minutes[1], parseSize(fields[1]), float(fields[2])))
+    return schedule
+
+def formatRate(bytesPerSecond):
+    if not bytesPerSecond:
+        return "unlimited"
+    for unit, size in (("GB/s", 1024 ** 3), ("MB/s", 1024 ** 2), ("KB/s", 1024)):
+        if bytesPerSecond >= size:
+            return "%.1f %s" % (bytesPerSecond / float(size), unit)
+    return "%d B/s" % bytesPerSecond
+
+
+class Rate_Limiter(object):
+    """Bytes/sec and requests/sec caps for all workers, by time of day"""
+
+    # seconds of history behind the throughput figure
+    WINDOW = 5.0
+
+    def __init__(self, schedule=()):
+        self.schedule = list(schedule)
+        self._bytes = Token_Bucket()
+        self._requests = Token_Bucket()
+        self._limits = (0, 0)
+        self._lock = threading.Lock()
+        self._history = collections.deque()
+
+    def limits(self, now=None):
+        now = now or dt.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, bytesPerSecond, requestsPerSecond in self.schedule:
+            if start == end:
+                # "00:00-00:00" is the whole day
+                inside = True
+            elif start < end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+            if inside:
+                return (bytesPerSecond, requestsPerSecond)
+        return (0, 0)
+
+    def _refresh(self):
+        limits = self.limits()
+        if limits != self._limits:
+            self._limits = limits
+            self._bytes.setRate(limits[0])
+            self._requests.setRate(limits[1])
+
+    def byteRate(self):
+        self._refresh()
+        return self._limits[0]
+
+    def request(self, n=1):
+        self._refresh()
+        self._requests.acquire(n)
+
+    def transfer(self, n):
+        self._refresh()
+        self._bytes.acquire(n)
+        now = time.time()
+        with self._lock:
+            self._history.append((now, n))
+            while self._history and self._history[0][0] < now - self.WINDOW:
+                self._history.popleft()
+
+    def throughput(self):
+        # bytes/sec over the last WINDOW seconds
+        now = time.time()
+        with self._lock:
+            total = sum(n for t, n in self._history if t >= now - self.WINDOW)
+        return total / self.WINDOW
+
+
+class Slice_Reader(object):
+    """File-like view of length bytes of f from offset; tell() and seek() count from the slice start"""
+
+    def __init__(self, f, offset, length):
+        self._f = f
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+        f.seek(offset)
+
+    def read(self, size=-1):
+        remaining = self._length - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self._f.read(size)
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        # resumable uploads rewind to the last confirmed byte after an error
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        self._f.seek(self._offset + self._pos)
+        return self._pos
+
+
+class Throttled_Reader(object):
+    """File-like object that charges every read against a Rate_Limiter"""
+
+    def __init__(self, f, limiter):
+        self._f = f
+        self._limiter = limiter
+        self._pos = 0
+
+    def read(self, size=-1):
+        # the whole size is returned, since a short read means end of file
+        # to the client library, but it is read and charged in small parts
+        # to keep the stream close to the cap
+        parts = []
+        while size != 0:
+            data = self._f.read(HASH_BLOCK_SIZE if size < 0 else min(size, HASH_BLOCK_SIZE))
+            if not data:
+                break
+            self._limiter.transfer(len(data))
+            parts.append(data)
+            if size > 0:
+                size -= len(data)
+        data = b''.join(parts)
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        # the client library asks where a resumable upload starts
+        return self._pos
+
+
+class Gzip_Reader(object):
+    """File-like object that returns the gzip of another file while it is read"""
+
+    def __init__(self, f, level=COMPRESS_LEVEL):
+        self._f = f
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._buffer = b''
+        self._eof = False
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block = self._f.read(HASH_BLOCK_SIZE)
+            if block:
+                self.bytesIn += len(block)
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytesOut += len(data)
+        return data
+
+    def tell(self):
+        # bytes of gzip handed out; the client library asks for it
+        return self.bytesOut
+
+def shouldCompress(path):
+    # skips formats that are compressed already, then deflates a sample from
+    # the start of the file and only says yes when it shrinks enough
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    try:
+        if os.path.getsize(path) < COMPRESS_MIN_SIZE:
+            return False
+        with open(path, 'rb') as f:
+            sample = f.read(COMPRESS_SAMPLE_SIZE)
+    except (IOError, OSError):
+        return False
+    return len(zlib.compress(sample, 1)) <= len(sample) * COMPRESS_MAX_RATIO
+
+def contentType(path):
+    # what gsutil cp and upload_from_filename would store for path, None
+    # when the name says nothing (the backend default then applies)
+    import mimetypes
+    return mimetypes.guess_type(path)[0]
+
+def compressedUpload(transport, path, name):
+    try:
+        with open(path, 'rb') as f:
+            reader = Gzip_Reader(f)
+            stream = reader
+            if transport.limiter is not None:
+                # the cap applies to the bytes on the wire
+                stream = Throttled_Reader(reader, transport.limiter)
+            result = transport.uploadStream(stream, name, "gzip", contentType(path))
+    except (IOError, OSError) as error:
+        print(error)
+        return "NG"
+    if result == "OK":
+        transport.stats.setdefault(path, {})["bytes_saved"] = reader.bytesIn - reader.bytesOut
+    return result
+
+def throttledUpload(transport, path, name):
+    try:
+        with open(path, 'rb') as f:
+            return transport.uploadStream(Throttled_Reader(f, transport.limiter), name, None, contentType(path))
+    except (IOError, OSError) as error:
+        print(error)
+        return "NG"
+
+def uploadOne(transport, path, name, compress=None):
+    # compress is the shouldCompress() answer when the caller has it already
+    size = _fileSize(path)
+    limiter = transport.limiter
+    if limiter is not None:
+        limiter.request()
+    if transport.checkpointDir:
+        if transport.composite and size >= transport.compositeThreshold:
+            return compositeUpload(transport, path, name)
+        if transport.resumable and size >= transport.resumableThreshold:
+            return resumableUpload(transport, path, name)
+    if compress is None:
+        compress = transport.compress and shouldCompress(path)
+    if compress:
+        return compressedUpload(transport, path, name)
+    if limiter is not None and limiter.byteRate():
+        return throttledUpload(transport, path, name)
+    result = transport.upload(path, name)
+    if limiter is not None:
+        # uncapped right now, but still counted for the throughput figure
+        limiter.transfer(size)
+    return result
+
+def uploadBatch(transport, items, sizes=None):
+    # a batch cannot be throttled while it runs, so its requests and bytes
+    # are charged up front. _planGroups makes no batches under a byte cap;
+    # one planned before a cap came into force is sent file by file
+    if transport.limiter is not None:
+        if transport.limiter.byteRate():
+            return [uploadOne(transport, path, name) for path, name in items]
+        transport.limiter.request(len(items))
+        if sizes is None:
+            sizes = [_fileSize(path) for path, name in items]
+        transport.limiter.transfer(sum(sizes))
+    return transport.uploadBatch(items)
+
+def loadConfig(path=CONFIG_FILE):
+    config = dict(DEFAULT_CONFIG)
+
+    parser = configparser.RawConfigParser()
+    if os.path.exists(path):
+        with io.open(path, 'r', encoding='utf-8') as f:
+            parser.read_file(f)
+
+    if parser.has_section("upload"):
+        for key, value in parser.items("upload"):
+            # options take the type of their default; blank keeps the
+            # default, except that a blank exclude turns the default
+            # exclude rules off
+            default = DEFAULT_CONFIG.get(key)
+            if not value.strip() and default and key != "exclude":
+                continue
+            if isinstance(default, bool):
+                value = value.strip().lower() in ("1", "yes", "true", "on")
+            elif isinstance(default, int):
+                value = int(value)
+            elif isinstance(default, float):
+                value = float(value)
+            config[key] = value
+
+    return config
+
+def scheduleOrder(weights, strategy=SCHEDULE_STRATEGY):
+    # order in which to start jobs of the given sizes so that the workers
+    # finish close together:
+    #   fifo        as listed
+    #   largest     biggest first (LPT); small jobs fill the gaps at the end
+    #   interleave  biggest, smallest, next biggest, ... keeps a mix in flight
+    order = list(range(len(weights)))
+    if strategy == "fifo":
+        return order
+    order.sort(key=lambda i: weights[i], reverse=True)
+    if strategy == "largest":
+        return order
+    if strategy == "interleave":
+        mixed = []
+        front, back = 0, len(order) - 1
+        while front <= back:
+            mixed.append(order[front])
+            if front != back:
+                mixed.append(order[back])
+            front += 1
+            back -= 1
+        return mixed
+    raise ValueError("unknown schedule '%s', expected one of %s" % (strategy, ", ".join(SCHEDULE_STRATEGIES)))
+
+def uploadFiles(listOfFiles, transport, dirName, workers=UPLOAD_WORKERS, callback=None, batchSize=UPLOAD_BATCH_SIZE,
+                strategy=SCHEDULE_STRATEGY, retries=UPLOAD_RETRIES, controller=None, engine=UPLOAD_ENGINE,
+                executor=None, sizes=None):
+    # run up to `workers` transfers at once, or as many as controller allows;
+    # failed files are retried with backoff up to `retries` more times and
+    # results keep the order of listOfFiles. executor, if given, is a thread
+    # pool shared with other calls running at the same time; sizes, the file
+    # sizes found by the scan, saves looking them up again
+    if engine == "asyncio":
+        import aioupload
+        return aioupload.uploadFiles(listOfFiles, transport, dirName, workers, callback, batchSize,
+                                     strategy, retries, controller, sizes)
+    if engine != "threads":
+        raise ValueError("unknown engine '%s', expected one of %s" % (engine, ", ".join(UPLOAD_ENGINES)))
+
+    results = [None] * len(listOfFiles)
+    if not listOfFiles:
+        return results
+
+    items = [(elem, transport.objectName(dirName, elem)) for elem in listOfFiles]
+    if sizes is None:
+        sizes = [_fileSize(elem) for elem in listOfFiles]
+    groups, compressed = _planGroups(items, sizes, transport, batchSize, strategy)
+
+    attempts = [0] * len(items)
+    # groups whose failed files wait for another try: (due, sequence, group)
+    retryQueue = []
+    sequence = itertools.count()
+    completed = queue.Queue()
+    poolSize = controller.maximum if controller is not None else workers
+
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=max(1, poolSize))
+    try:
+        running = {}
+
+        def submit(group):
+            for i in group:
+                attempts[i] += 1
+            future = executor.submit(_runGroup, transport, [items[i] for i in group], controller,
+                                     group[0] in compressed, [sizes[i] for i in group])
+            running[future] = group
+            future.add_done_callback(completed.put)
+
+        for group in groups:
+            submit(group)
+
+        done = 0
+        # completions are handled here on the calling thread so that the
+        # callback may safely touch Tk widgets
+        while running or retryQueue:
+            timeout = None
+            if retryQueue:
+                timeout = max(0, retryQueue[0][0] - time.time())
+            try:
+                future = completed.get(timeout=timeout)
+            except queue.Empty:
+                future = None
+
+            if future is not None:
+                group = running.pop(future)
+                failed = []
+                for i, result in zip(group, future.result()):
+                    if result == "NG" and attempts[i] <= retries:
+                        failed.append(i)
+                    else:
+                        results[i] = result
+                        done += 1
+                if failed:
+                    delay = retryDelay(max(attempts[i] for i in failed))
+                    heapq.heappush(retryQueue, (time.time() + delay, next(sequence), failed))
+                if callback is not None:
+                    callback(done)
+
+            while retryQueue and retryQueue[0][0] <= time.time():
+                submit(heapq.heappop(retryQueue)[2])
+    finally:
+        if owned:
+            executor.shutdown()
+
+    for (path, name), count in zip(items, attempts):
+        transport.stats.setdefault(path, {})["attempts"] = count
+
+    return results
+
+def _planGroups(items, sizes, transport, batchSize=UPLOAD_BATCH_SIZE, strategy=SCHEDULE_STRATEGY):
+    # (groups, compressed): lists of indexes into items, one per transfer, in
+    # the order to start them, and the set of indexes to gzip. Those always
+    # go on their own, so a group gets gzipped when its first file does
+    batchSize = max(1, batchSize)
+    if transport.limiter is not None and transport.limiter.byteRate():
+        # only single files are sent through Throttled_Reader; a batch would
+        # go out at full speed with its bytes charged beforehand
+        batchSize = 1
+
+    # files big enough for checkpointed chunks, and files that get gzipped,
+    # always go on their own; batches keep folder order so gsutil -I needs
+    # few processes
+    groups = []
+    batched = []
+    compressed = set()
+    for i, (path, name) in enumerate(items):
+        if _isLarge(transport, path, sizes[i]):
+            groups.append([i])
+        elif transport.compress and shouldCompress(path):
+            compressed.add(i)
+            groups.append([i])
+        elif batchSize == 1:
+            groups.append([i])
+        else:
+            batched.append(i)
+    for i in range(0, len(batched), batchSize):
+        groups.append(batched[i:i + batchSize])
+
+    # the pool starts groups in submission order, so that order decides
+    # whether one big file ends up running alone at the end
+    weights = [sum(sizes[i] for i in group) for group in groups]
+    return [groups[g] for g in scheduleOrder(weights, strategy)], compressed
+
+def retryDelay(attempt):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+def _runGroup(transport, items, controller=None, compress=None, sizes=None):
+    # one transfer on a pool thread; never raises, so a single bad file
+    # cannot take the whole run down. compress is passed on to uploadOne,
+    # sizes to uploadBatch
+    if controller is not None:
+        controller.acquire()
+    start = time.time()
+    chunk = ["NG"] * len(items)
+    try:
+        if len(items) == 1:
+            chunk = [uploadOne(transport, items[0][0], items[0][1], compress)]
+        else:
+            chunk = uploadBatch(transport, items, sizes)
+    except Exception as error:
+        print(error)
+    finally:
+        if controller is not None:
+            controller.release("NG" not in chunk, time.time() - start, len(items), sum(sizes) if sizes else 0)
+    return chunk
+
+
+class Concurrency_Controller(object):
+    """AIMD limit on the number of transfers in flight
+
+    The limit grows by one after every window of `limit` finished transfers
+    whose throughput beat the previous window, and halves (once per window)
+    on a failure or on a transfer that took LATENCY_SPIKE times the usual.
+    Transfers are compared by seconds per unit of work, one unit being a
+    file or SPIKE_UNIT bytes, so a big file or batch is not taken for a
+    slow network.
+    """
+
+    LATENCY_SPIKE = 3.0
+    SPIKE_UNIT = 1024 * 1024
+
+    def __init__(self, initial, minimum=1, maximum=UPLOAD_MAX_WORKERS):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._latency = None
+        self._samples = 0
+        self._resetWindow()
+        self._lastRate = 0.0
+
+    def _resetWindow(self):
+        self._windowStart = time.time()
+        self._windowDone = 0
+        self._windowCut = False
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= int(self.limit):
+                self._cond.wait()
+            self._active += 1
+
+    def tryAcquire(self):
+        # acquire() for callers that must not block (the asyncio engine)
+        with self._cond:
+            if self._active >= int(self.limit):
+                return False
+            self._active += 1
+            return True
+
+    def release(self, ok, latency, units=1, size=0):
+        # units files of size bytes in all took latency seconds
+        latency /= units + size / float(self.SPIKE_UNIT)
+        with self._cond:
+            self._active -= 1
+
+            spike = (self._samples >= 10 and self._latency is not None and
+                     latency > self._latency * self.LATENCY_SPIKE)
+            # moving average of how long a unit of work usually takes
+            self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+            self._samples += 1
+
+            if not ok or spike:
+                if not self._windowCut:
+                    self.limit = max(self.minimum, self.limit / 2.0)
+                    self._windowCut = True
+            else:
+                self._windowDone += units
+                if self._windowDone >= int(self.limit):
+                    rate = self._windowDone / max(time.time() - self._windowStart, 1e-6)
+                    if not self._windowCut and rate > self._lastRate:
+                        self.limit = min(self.maximum, self.limit + 1)
+                    self._lastRate = rate
+                    self._resetWindow()
+
+            self._cond.notify_all()
+
+def _fileSize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _isLarge(transport, path, size=None):
+    # files that get a chunked or composite transfer of their own
+    if size is None:
+        size = _fileSize(path)
+    return ((transport.resumable and size >= transport.resumableThreshold) or
+            (transport.composite and size >= transport.compositeThreshold))
+
+def _crc32cTable():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+try:
+    import google_crc32c
+
+    def crc32c(data, crc=0):
+        return google_crc32c.extend(crc, bytes(data))
+    CRC32C_NATIVE = True
+except ImportError:
+    CRC32C_TABLE = []
+
+    def crc32c(data, crc=0):
+        # pure Python fallback; pip install google-crc32c for the C version
+        if not CRC32C_TABLE:
+            CRC32C_TABLE[:] = _crc32cTable()
+        table = CRC32C_TABLE
+        crc ^= 0xFFFFFFFF
+        for b in bytearray(data):
+            crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+        return crc ^ 0xFFFFFFFF
+    CRC32C_NATIVE = False
+
+# the pure Python CRC32C is far too slow to run by default on large trees
+HASH_ALGORITHMS = ("md5", "crc32c") if CRC32C_NATIVE else ("md5",)
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+# files at least this big are hashed through mmap instead of read()
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024
+
+def hashFile(path, algorithms=HASH_ALGORITHMS):
+    # one streaming pass computing every requested digest; returns hex strings
+    md5 = hashlib.md5() if "md5" in algorithms else None
+    crc = [0] if "crc32c" in algorithms else None
+
+    def update(block):
+        if md5 is not None:
+            md5.update(block)
+        if crc is not None:
+            crc[0] = crc32c(block, crc[0])
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= HASH_MMAP_THRESHOLD:
+            import mmap
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(mapped)
+                for offset in range(0, size, HASH_BLOCK_SIZE):
+                    update(view[offset:offset + HASH_BLOCK_SIZE])
+                view.release()
+            finally:
+                mapped.close()
+        else:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                update(block)
+
+    digests = {}
+    if md5 is not None:
+        digests["md5"] = md5.hexdigest()
+    if crc is not None:
+        digests["crc32c"] = "%08x" % crc[0]
+    return digests
+
+def _hashWorker(args):
+    # top level so ProcessPoolExecutor can pickle it
+    path, algorithms = args
+    try:
+        return hashFile(path, algorithms)
+    except (IOError, OSError):
+        return None
+
+def _hashPool(workers):
+    # hashing processes come from a forkserver (spawn where there is none):
+    # pools are created while other threads run, and a forked child would
+    # inherit locks held by those threads
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+class Hash_Cache(object):
+    """Digests keyed by (device, inode, size, mtime) so unchanged files are never re-read
+
+    Unlike the other SQLite stores this one may be used from several
+    threads: the waves of a pipeline run hash files concurrently.
+    """
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        import sqlite3
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            md5 TEXT,
+            crc32c TEXT,
+            PRIMARY KEY (device, inode, size, mtime))""")
+
+    @staticmethod
+    def _key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def get(self, st, algorithms=HASH_ALGORITHMS):
+        with self._lock:
+            row = self._db.execute("SELECT md5, crc32c FROM hashes WHERE device = ? AND inode = ? AND size = ? AND mtime = ?",
+                                   self._key(st)).fetchone()
+        if row is None:
+            return None
+        digests = dict((name, value) for name, value in zip(("md5", "crc32c"), row) if value)
+        # an entry computed with fewer algorithms is a miss
+        for name in algorithms:
+            if name not in digests:
+                return None
+        return digests
+
+    def put(self, st, digests):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                             self._key(st) + (digests.get("md5"), digests.get("crc32c")))
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def hashFiles(listOfFiles, cache=None, workers=HASH_WORKERS, algorithms=HASH_ALGORITHMS, pool=None):
+    # digests for every file in listOfFiles (None where it could not be read);
+    # cache hits never touch the file contents, misses run on a process pool
+    # so CRC work is not serialized on the GIL. pool, if given, is a
+    # ProcessPoolExecutor kept for the whole run instead of one per call
+    results = [None] * len(listOfFiles)
+    misses = []
+    for i, elem in enumerate(listOfFiles):
+        try:
+            st = os.stat(elem)
+        except OSError:
+            continue
+        digests = cache.get(st, algorithms) if cache is not None else None
+        if digests is None:
+            misses.append((i, st))
+        else:
+            results[i] = digests
+
+    jobs = [(listOfFiles[i], algorithms) for i, st in misses]
+    if pool is not None and len(jobs) > 1:
+        computed = list(pool.map(_hashWorker, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    elif workers > 1 and len(jobs) > 1:
+        # multiprocessing is only paid for when there is hashing to do
+        with _hashPool(workers) as executor:
+            computed = list(executor.map(_hashWorker, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        computed = [_hashWorker(job) for job in jobs]
+
+    for (i, st), digests in zip(misses, computed):
+        results[i] = digests
+        if cache is not None and digests is not None:
+            cache.put(st, digests)
+    if cache is not None:
+        cache.commit()
+
+    return results
+
+
+class Sync_Manifest(object):
+    """Files already uploaded, keyed by local path and destination object"""
+
+    def __init__(self, path, hashes=None, hashWorkers=HASH_WORKERS, hashPool=None):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        # optional Hash_Cache and process pool shared with the rest of the run
+        self.hashes = hashes
+        self.hashWorkers = hashWorkers
+        self.hashPool = hashPool
+
+        import sqlite3
+        self._db = sqlite3.connect(path)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            md5 TEXT NOT NULL,
+            uploaded TEXT NOT NULL,
+            PRIMARY KEY (path, destination))""")
+
+    def _row(self, path, destination):
+        # (key, row): files are kept under their absolute path, so the
+        # working directory of a run does not matter; entries written
+        # before that under the path as given are still found
+        key = os.path.abspath(path)
+        for candidate in (key, path) if key != path else (key,):
+            row = self._db.execute("SELECT size, mtime, md5 FROM files WHERE path = ? AND destination = ?",
+                                   (candidate, destination)).fetchone()
+            if row is not None:
+                return candidate, row
+        return key, None
+
+    def changed(self, path, destination):
+        # returns None when the file is already at destination unchanged,
+        # otherwise the (size, mtime) to record once the upload succeeds.
+        # Raises OSError when the file has gone
+        st = os.stat(path)
+        key, row = self._row(path, destination)
+        if row is None or row[0] != st.st_size:
+            return (st.st_size, st.st_mtime)
+        if row[1] == st.st_mtime:
+            return None
+
+        # touched but maybe not modified: only the content can tell
+        if self.md5([path])[0] == row[2]:
+            self._db.execute("UPDATE files SET mtime = ? WHERE path = ? AND destination = ?",
+                             (st.st_mtime, key, destination))
+            return None
+        return (st.st_size, st.st_mtime)
+
+    def md5(self, listOfFiles):
+        digests = hashFiles(listOfFiles, self.hashes, self.hashWorkers, ("md5",), self.hashPool)
+        return [digest["md5"] if digest else None for digest in digests]
+
+    def record(self, path, destination, size, mtime, md5):
+        key = os.path.abspath(path)
+        if key != path:
+            # an entry from before absolute keys
+            self._db.execute("DELETE FROM files WHERE path = ? AND destination = ?", (path, destination))
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, destination, size, mtime, md5, dt.datetime.now().isoformat()))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def findDuplicates(listOfFiles, hashes=None, hashWorkers=HASH_WORKERS, hashPool=None, sizes=None):
+    # maps the index of every file whose content already appears earlier in
+    # listOfFiles to the index of that first copy. Only files sharing a size
+    # with another file are hashed.
+    bySize = {}
+    for i, elem in enumerate(listOfFiles):
+        try:
+            size = sizes[i] if sizes is not None else os.path.getsize(elem)
+        except OSError:
+            continue
+        bySize.setdefault(size, []).append(i)
+
+    candidates = sorted(i for group in bySize.values() if len(group) > 1 for i in group)
+    digests = hashFiles([listOfFiles[i] for i in candidates], hashes, hashWorkers, ("md5",), hashPool)
+
+    first = {}
+    duplicates = {}
+    for i, digest in zip(candidates, digests):
+        if digest is None:
+            continue
+        key = (sizes[i] if sizes is not None else os.path.getsize(listOfFiles[i]), digest["md5"])
+        if key in first:
+            duplicates[i] = first[key]
+        else:
+            first[key] = i
+    return duplicates
+
+def dedupFiles(listOfFiles, transport, dirName, workers=UPLOAD_WORKERS, callback=None, hashes=None, hashWorkers=HASH_WORKERS,
+               hashPool=None, sizes=None, **options):
+    # like uploadFiles, but identical files are sent once and the other
+    # copies are made with transport.copy(); those report DEDUPLICATED.
+    # options are passed on to uploadFiles
+    results = [None] * len(listOfFiles)
+    duplicates = findDuplicates(listOfFiles, hashes, hashWorkers, hashPool, sizes)
+    unique = [i for i in range(len(listOfFiles)) if i not in duplicates]
+
+    def progress(base):
+        if callback is None:
+            return None
+        return lambda done: callback(base + done)
+
+    pick = lambda indexes: [sizes[i] for i in indexes] if sizes is not None else None
+    uploaded = uploadFiles([listOfFiles[i] for i in unique], transport, dirName, workers, callback,
+                           sizes=pick(unique), **options)
+    for i, result in zip(unique, uploaded):
+        results[i] = result
+
+    copied = 0
+    copies = sorted(i for i in duplicates if results[duplicates[i]] == "OK")
+    if copies:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {}
+            for i in copies:
+                name = transport.objectName(dirName, listOfFiles[duplicates[i]])
+                future = executor.submit(transport.copy, name, transport.objectName(dirName, listOfFiles[i]))
+                futures[future] = i
+
+            for future in as_completed(futures):
+                if future.result() == "OK":
+                    results[futures[future]] = "DEDUPLICATED"
+                    copied += 1
+                    if callback is not None:
+                        callback(len(unique) + copied)
+
+    # copies whose original failed to upload, or whose copy failed, are sent in full
+    leftovers = [i for i in sorted(duplicates) if results[i] is None]
+    uploaded = uploadFiles([listOfFiles[i] for i in leftovers], transport, dirName, workers,
+                           progress(len(unique) + copied), sizes=pick(leftovers), **options)
+    for i, result in zip(leftovers, uploaded):
+        results[i] = result
+
+    return results
+
+# bundle names of this process: <started>-<random id>-<call>; packFiles()
+# runs once per pipeline wave or watch batch, often within one second
+_packRun = []
+_packCalls = itertools.count(1)
+
+def _packPrefix(dirName):
+    if not _packRun:
+        import uuid
+        _packRun.append("%s-%s" % (dt.datetime.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8]))
+    return "%s/_bundles/%s-%04d" % (os.path.basename(dirName.rstrip('/\\')), _packRun[0], next(_packCalls))
+
+def packFiles(listOfFiles, transport, dirName, workers=UPLOAD_WORKERS, callback=None, bundleSize=PACK_BUNDLE_SIZE,
+              executor=None):
+    # streams the (small) files into tar bundles of about bundleSize bytes,
+    # uploads each bundle as soon as it is closed and finally a sidecar
+    # <run>.index.csv mapping every object name to its bundle, data offset
+    # and size. Bundles are spooled to disk, never held in memory. A file is
+    # PACKED only once both its bundle and the index are uploaded, so the
+    # sync manifest never records a file that cannot be restored. executor
+    # is an optional thread pool shared with other uploads, as in uploadFiles
+    import tarfile
+    results = [None] * len(listOfFiles)
+    if not listOfFiles:
+        return results
+
+    prefix = _packPrefix(dirName)
+    workdir = tempfile.mkdtemp(prefix="gcp_bundles_")
+    entries = []
+
+    def send(bundlePath, bundleName):
+        try:
+            # never gzipped: GCS ignores Range on transcoded objects, so the
+            # index offsets could not be read from
+            return uploadOne(transport, bundlePath, bundleName, compress=False)
+        finally:
+            os.remove(bundlePath)
+
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        try:
+            futures = {}
+            members = []
+            tar = None
+
+            for i, elem in enumerate(listOfFiles + [None]):
+                if tar is not None and (elem is None or tar.offset >= bundleSize):
+                    tar.close()
+                    futures[executor.submit(send, bundlePath, bundleName)] = members
+                    tar = None
+                if elem is None:
+                    break
+
+                if tar is None:
+                    bundleName = "%s-%04d.tar" % (prefix, len(futures) + 1)
+                    bundlePath = os.path.join(workdir, os.path.basename(bundleName))
+                    tar = tarfile.open(bundlePath, "w", format=tarfile.PAX_FORMAT)
+                    members = []
+
+                name = transport.objectName(dirName, elem)
+                try:
+                    tar.add(elem, arcname=name, recursive=False)
+                except (IOError, OSError) as error:
+                    print(error)
+                    results[i] = "NG"
+                    continue
+                size = tar.members[-1].size
+                # only the offsets are kept, not the growing TarInfo list
+                tar.members = []
+                # the data sits just before the current end, padded to 512 byte blocks
+                entries.append([name, bundleName, tar.offset - (-(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE), size])
+                members.append(i)
+
+            done = 0
+            for future in as_completed(futures):
+                result = "PACKED" if future.result() == "OK" else "NG"
+                for i in futures[future]:
+                    results[i] = result
+                done += len(futures[future])
+                if callback is not None:
+                    callback(done)
+        finally:
+            if owned:
+                executor.shutdown()
+
+        indexPath = os.path.join(workdir, "index.csv")
+        with io.open(indexPath, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "bundle", "offset", "size"])
+            writer.writerows(entries)
+        if transport.upload(indexPath, prefix + ".index.csv") != "OK":
+            # without the index the bundles cannot be unpacked file by file
+            results = ["NG" if result == "PACKED" else result for result in results]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+def sendFiles(listOfFiles, transport, dirName, config, callback=None, hashes=None, controller=None, executor=None,
+              hashPool=None, sizes=None):
+    # one upload run with the optional stages from config: small files are
+    # packed into bundles, identical files deduplicated, the rest uploaded.
+    # A run made of several calls passes in its own Concurrency_Controller,
+    # transfer thread pool and hash process pool so they outlive each call.
+    # sizes are the file sizes from the scan, looked up here when missing
+    results = [None] * len(listOfFiles)
+    progress = [0]
+    if sizes is None:
+        sizes = [_fileSize(elem) for elem in listOfFiles]
+
+    def stage(n):
+        # callbacks from consecutive stages add up to one running total
+        if callback is None:
+            return None
+        base = progress[0]
+        progress[0] += n
+        return lambda done: callback(base + done)
+
+    rest = list(range(len(listOfFiles)))
+    if config["pack"]:
+        small = [i for i in rest if sizes[i] < config["pack_max_file_size"]]
+        if len(small) > 1:
+            packed = packFiles([listOfFiles[i] for i in small], transport, dirName, config["workers"],
+                               stage(len(small)), config["pack_bundle_size"], executor)
+            for i, result in zip(small, packed):
+                results[i] = result
+            rest = [i for i in rest if results[i] is None]
+
+    options = {
+        "batchSize": config["batch_size"],
+        "strategy": config["schedule"],
+        "retries": config["retries"],
+        "controller": controller,
+        "engine": config["engine"],
+        "executor": executor,
+    }
+    if config["adaptive"] and controller is None:
+        options["controller"] = Concurrency_Controller(config["workers"], 1, config["max_workers"])
+
+    restFiles = [listOfFiles[i] for i in rest]
+    restSizes = [sizes[i] for i in rest]
+    if config["dedup"]:
+        sent = dedupFiles(restFiles, transport, dirName, config["workers"], stage(len(rest)),
+                          hashes, config["hash_workers"], hashPool, restSizes, **options)
+    else:
+        sent = uploadFiles(restFiles, transport, dirName, config["workers"], stage(len(rest)), sizes=restSizes,
+                           **options)
+    for i, result in zip(rest, sent):
+        results[i] = result
+
+    return results
+
+def syncFiles(listOfFiles, transport, dirName, manifest, config, callback=None):
+    # upload only new or modified files; the rest are reported as SKIPPED
+    results, pending = _syncPlan(listOfFiles, transport, dirName, manifest)
+
+    skipped = len(listOfFiles) - len(pending)
+    if callback is not None:
+        callback(skipped)
+        progress = lambda done: callback(skipped + done)
+    else:
+        progress = None
+
+    uploaded = sendFiles([listOfFiles[i] for i, destination, stat in pending],
+                         transport, dirName, config, progress, manifest.hashes, hashPool=manifest.hashPool,
+                         sizes=[stat[0] for i, destination, stat in pending])
+    _syncRecord(listOfFiles, results, pending, uploaded, manifest)
+    return results
+
+def _syncPlan(listOfFiles, transport, dirName, manifest):
+    # (results, pending): SKIPPED or NG results for the files that need no
+    # upload, and (index, destination, (size, mtime)) for the rest
+    results = ["SKIPPED"] * len(listOfFiles)
+    pending = []
+    for i, elem in enumerate(listOfFiles):
+        destination = "%s/%s" % (transport.destination, transport.objectName(dirName, elem))
+        try:
+            stat = manifest.changed(elem, destination)
+        except OSError as error:
+            # deleted or renamed since the scan
+            print(error)
+            results[i] = "NG"
+            continue
+        if stat is not None:
+            pending.append((i, destination, stat))
+    return results, pending
+
+def _syncRecord(listOfFiles, results, pending, uploaded, manifest):
+    # fills in the upload results and records the files that arrived
+    done = []
+    for (i, destination, stat), result in zip(pending, uploaded):
+        results[i] = result
+        if result in ("OK", "DEDUPLICATED", "PACKED"):
+            done.append((i, destination, stat))
+
+    # hashed together so the work spreads over the hash process pool. The
+    # uploads do not hash, so a new file is read once more here; the cached
+    # digest is what spares the next runs
+    digests = manifest.md5([listOfFiles[i] for i, destination, stat in done])
+    for (i, destination, stat), md5 in zip(done, digests):
+        if md5 is not None:
+            manifest.record(listOfFiles[i], destination, stat[0], stat[1], md5)
+    manifest.commit()
+
+def _openManifest(config, hashPool=None):
+    # the sync manifest of an incremental run, None otherwise; SQLite
+    # connections stay on the thread that opened them
+    if not config["incremental"]:
+        return None
+    hashes = Hash_Cache(os.path.join(config["state_dir"], "hashes.db"))
+    return Sync_Manifest(os.path.join(config["state_dir"], "manifest.db"), hashes, config["hash_workers"], hashPool)
+
+def _closeManifest(manifest):
+    if manifest is not None:
+        manifest.close()
+        manifest.hashes.close()
+
+def _resultRows(listOfFiles, results, stats, first=1):
+    # [no, path, result, bytes_saved, attempts] rows for writeCSV; the stats
+    # of those files are dropped as they are used
+    data = []
+    for k, (elem, result) in enumerate(zip(listOfFiles, results), first):
+        fileStats = stats.pop(elem, {})
+        data.append([k, elem, result, fileStats.get("bytes_saved", 0), fileStats.get("attempts", 0)])
+    return data
+
+def uploadFolder(listOfFiles, dirName, config, transport, callback=None):
+    # one upload run over a list made up front (watch mode); returns the
+    # writeCSV rows
+    transport.stats.clear()
+    if transport.normalizer is not None:
+        transport.normalizer.reset()
+    manifest = _openManifest(config)
+    try:
+        if manifest is not None:
+            results = syncFiles(listOfFiles, transport, dirName, manifest, config, callback)
+        else:
+            results = sendFiles(listOfFiles, transport, dirName, config, callback)
+    finally:
+        _closeManifest(manifest)
+    return _resultRows(listOfFiles, results, transport.stats)
+
+def estimateTotal(files, counts, finished):
+    # files the scan will end up with: the files per folder read so far times
+    # the folders known so far, exact once the scan has finished
+    if finished or not counts.get("listed"):
+        return files
+    return max(files, int(files * counts["folders"] / float(counts["listed"])))
+
+def uploadPipeline(dirName, config, transport, callback=None, rowsCallback=None, counts=None):
+    # scan -> transfer -> log, overlapped. A scan thread walks dirName into a
+    # bounded queue; a transfer thread takes whatever is queued (up to a
+    # wave of workers * batch_size files) and hands it to sendFiles() on one
+    # of PIPELINE_WAVES wave threads. All waves share one transfer pool,
+    # Concurrency_Controller and hash process pool, so a new wave's groups
+    # are queued while the previous one is still running. The sync manifest
+    # is only touched on the transfer thread. This thread hands each
+    # finished wave's rows, in scan order, to rowsCallback(rows) and calls
+    # callback(done, total) with total estimated until the scan is over.
+    # Both callbacks run on the calling thread, so they may touch Tk.
+    # Returns a Counter of results. Dedup and packing work per wave. The
+    # config's include/exclude rules and limits are applied during the
+    # scan; counts, if given, gets the scan counts of walkFiles()
+    waveSize = max(1, config["workers"]) * max(1, config["batch_size"])
+    scanned = queue.Queue(maxsize=2 * waveSize)
+    finished = queue.Queue()
+    if counts is None:
+        counts = {}
+    fileFilter = getFilter(config)
+    found = [0]
+    scanDone = threading.Event()
+    stop = threading.Event()
+    errors = []
+    # waves are numbered as they start and reported in that order
+    waveIds = itertools.count()
+    finishedWaves = [0]
+
+    def scan():
+        index = None
+        entries = None
+        try:
+            if config["scan_index"]:
+                # SQLite connections stay on the thread that opened them
+                index = Scan_Index(os.path.join(config["state_dir"], "scan.db"))
+                entries = walkFilesIndexed(dirName, index, counts=counts, fileFilter=fileFilter)
+            elif config["scan_workers"] > 1:
+                entries = walkFilesParallel(dirName, config["scan_workers"], config["scan_ordered"], counts=counts,
+                                            fileFilter=fileFilter)
+            else:
+                entries = walkFiles(dirName, counts=counts, fileFilter=fileFilter)
+            for entry in entries:
+                found[0] += 1
+                while not stop.is_set():
+                    try:
+                        scanned.put(entry, timeout=0.2)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+        except Exception as error:
+            errors.append(error)
+        finally:
+            if entries is not None:
+                entries.close()
+            if index is not None:
+                index.close()
+            scanDone.set()
+            scanned.put(None)
+
+    def transfer():
+        controller = None
+        if config["adaptive"]:
+            controller = Concurrency_Controller(config["workers"], 1, config["max_workers"])
+        poolSize = controller.maximum if controller is not None else config["workers"]
+        executor = ThreadPoolExecutor(max_workers=max(1, poolSize), thread_name_prefix="pipeline-upload")
+        waves = ThreadPoolExecutor(max_workers=PIPELINE_WAVES, thread_name_prefix="pipeline-wave")
+        hashPool = None
+        if config["hash_workers"] > 1 and (config["incremental"] or config["dedup"]):
+            hashPool = _hashPool(config["hash_workers"])
+        manifest = None
+        # (wave, results, pending, future) oldest first
+        inFlight = collections.deque()
+
+        def finish():
+            wave, results, pending, future = inFlight.popleft()
+            uploaded = future.result()
+            if manifest is not None:
+                _syncRecord(wave, results, pending, uploaded, manifest)
+            else:
+                results = uploaded
+            finished.put(("wave", (wave, results)))
+
+        try:
+            manifest = _openManifest(config, hashPool)
+            hashes = manifest.hashes if manifest is not None else None
+            ended = False
+            while inFlight or not (ended or stop.is_set()):
+                if ended or stop.is_set() or len(inFlight) >= PIPELINE_WAVES:
+                    finish()
+                    continue
+                if inFlight and inFlight[0][3].done():
+                    finish()
+                    continue
+                wave = []
+                try:
+                    # block on the scan only when there is nothing to finish
+                    item = scanned.get(timeout=0.05 if inFlight else None)
+                except queue.Empty:
+                    continue
+                # whatever the scan has ready within 50 ms of the first file
+                deadline = time.time() + 0.05
+                while item is not None:
+                    wave.append(item)
+                    if len(wave) >= waveSize:
+                        break
+                    try:
+                        item = scanned.get(timeout=max(0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+                ended = item is None
+                if not wave:
+                    continue
+
+                waveId = next(waveIds)
+                sizes = [entry.size for entry in wave]
+                wave = [entry.path for entry in wave]
+                if manifest is not None:
+                    results, pending = _syncPlan(wave, transport, dirName, manifest)
+                    files = [wave[i] for i, destination, stat in pending]
+                    sizes = [stat[0] for i, destination, stat in pending]
+                    skipped = len(wave) - len(pending)
+                else:
+                    results, pending, files, skipped = None, None, wave, 0
+                finished.put(("progress", (waveId, skipped)))
+                progress = lambda done, waveId=waveId, skipped=skipped: finished.put(("progress", (waveId, skipped + done)))
+                future = waves.submit(sendFiles, files, transport, dirName, config, progress, hashes,
+                                      controller, executor, hashPool, sizes)
+                inFlight.append((wave, results, pending, future))
+        except Exception as error:
+            errors.append(error)
+        finally:
+            # waves still running are let finish, but not recorded
+            waves.shutdown()
+            executor.shutdown()
+            if hashPool is not None:
+                hashPool.shutdown()
+            _closeManifest(manifest)
+            finished.put(None)
+
+    transport.stats.clear()
+    if transport.normalizer is not None:
+        transport.normalizer.reset()
+    scanner = threading.Thread(target=scan, name="pipeline-scan")
+    sender = threading.Thread(target=transfer, name="pipeline-transfer")
+    scanner.daemon = sender.daemon = True
+    scanner.start()
+    sender.start()
+
+    results = collections.Counter()
+    done = 0
+    # files finished so far in each wave still running
+    inWave = {}
+    try:
+        while True:
+            try:
+                message = finished.get(timeout=0.05)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                break
+            if message and message[0] == "progress":
+                waveId, waveDone = message[1]
+                if waveId >= finishedWaves[0]:
+                    inWave[waveId] = waveDone
+            elif message:
+                wave, waveResults = message[1]
+                rows = _resultRows(wave, waveResults, transport.stats, done + 1)
+                done += len(wave)
+                inWave.pop(finishedWaves[0], None)
+                finishedWaves[0] += 1
+                results.update(waveResults)
+                if rowsCallback is not None:
+                    rowsCallback(rows)
+            if callback is not None:
+                callback(done + sum(inWave.values()), estimateTotal(found[0], counts, scanDone.is_set()))
+    finally:
+        stop.set()
+        # unblock a scan waiting on a full queue, then a transfer waiting
+        # for the scan
+        while scanner.is_alive():
+            try:
+                scanned.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        scanned.put(None)
+        sender.join()
+
+    if errors:
+        raise errors[0]
+    if counts.get("pruned"):
+        print("%d files and folders left out by the filter rules" % counts["pruned"])
+    return results
+
+def changedSince(dirName, since):
+    # files under dirName written, created or moved in at or after since
+    # (st_ctime catches files moved in with an old mtime)
+    try:
+        for entry in walkFiles(dirName):
+            if max(entry.mtime, entry.ctime) >= since:
+                yield entry.path
+    except OSError as error:
+        # the folder went away between the event and the scan
+        print(error)
+
+
+class Polling_Watcher(object):
+    # portable fallback: rescan the tree every interval seconds and report
+    # what changed since the previous scan. Keeps one timestamp, not a
+    # snapshot of the tree.
+
+    def __init__(self, dirName, interval=WATCH_INTERVAL):
+        self.dirName = dirName
+        self.interval = interval
+        self.since = 0
+        self.nextScan = 0
+
+    def poll(self, timeout):
+        now = time.time()
+        if now < self.nextScan:
+            time.sleep(min(timeout, self.nextScan - now))
+            return []
+        # a little overlap so writes during the previous walk are not lost
+        since, self.since = self.since, now - 1
+        self.nextScan = now + self.interval
+        return changedSince(self.dirName, since)
+
+    def close(self):
+        pass
+
+
+class Inotify_Watcher(object):
+    # Linux inotify through ctypes; one watch per directory, added as
+    # directories appear. Raises OSError where inotify is not available.
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, dirName):
+        import ctypes
+        import ctypes.util
+        import struct
+        self._struct = struct
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._ctypes = ctypes
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.dirName = dirName
+        self.watches = {}
+        # everything already there is reported by the first poll()
+        self.rescan = 0
+        # start of the last poll whose events were all read; an overflow
+        # rescans from there
+        self._lastRead = time.time()
+        self._addTree(dirName)
+
+    def _addTree(self, dirName):
+        for root, dirs, files in os.walk(dirName):
+            wd = self._libc.inotify_add_watch(self.fd, root.encode(sys.getfilesystemencoding()), self.MASK)
+            if wd < 0:
+                error = self._ctypes.get_errno()
+                raise OSError(error, "%s: %s" % (root, os.strerror(error)))
+            self.watches[wd] = root
+
+    def poll(self, timeout):
+        import select
+        if self.rescan is not None:
+            since, self.rescan = self.rescan, None
+            return changedSince(self.dirName, since)
+
+        start = time.time()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            self._lastRead = start
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except (IOError, OSError):
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = self._struct.unpack_from("iIII", buf, offset)
+            name = buf[offset + 16:offset + 16 + length].rstrip(b"\0").decode(sys.getfilesystemencoding(), "surrogateescape")
+            offset += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # events were dropped, possibly long before this read; rescan
+                # everything changed since the last complete read
+                since, self._lastRead = self._lastRead, start
+                return changedSince(self.dirName, since - 1)
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name).replace('\\', '/')
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # files can land in it before the watch is in place
+                    try:
+                        self._addTree(path)
+                    except (IOError, OSError) as error:
+                        print(error)
+                    paths.extend(changedSince(path, 0))
+            else:
+                paths.append(path)
+        if len(buf) < 60 * 1024:
+            # the queue was drained, so nothing before start can be dropped
+            self._lastRead = start
+        # a large write comes in as many IN_MODIFY events
+        return list(collections.OrderedDict.fromkeys(paths))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def getWatcher(dirName, interval=WATCH_INTERVAL):
+    try:
+        return Inotify_Watcher(dirName)
+    except (OSError, AttributeError):
+        return Polling_Watcher(dirName, interval)
+
+def watchFolder(dirName, config, transport, callback=None, stop=None):
+    # continuous incremental upload: files that appear or change under
+    # dirName are uploaded once they have not changed for watch_settle
+    # seconds. callback(rows) gets the writeCSV rows of every batch. Runs
+    # until stop (a threading.Event) is set. Only files still settling are
+    # remembered; the sync manifest keeps track of what was already sent.
+    settle = config["watch_settle"]
+    fileFilter = getFilter(config)
+    watcher = getWatcher(dirName, config["watch_interval"])
+    print("watching %s (%s)" % (dirName, type(watcher).__name__))
+    if stop is None:
+        stop = threading.Event()
+    # bounded so a burst of files holds up the scan instead of piling up
+    ready = queue.Queue(maxsize=max(1, config["batch_size"]) * 2)
+
+    def send():
+        while not (stop.is_set() and ready.empty()):
+            try:
+                batch = [ready.get(timeout=0.2)]
+            except queue.Empty:
+                continue
+            while len(batch) < config["batch_size"]:
+                try:
+                    batch.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            batch = list(collections.OrderedDict.fromkeys(batch))
+            try:
+                rows = uploadFolder(batch, dirName, config, transport)
+            except Exception as error:
+                # one bad batch must not stop the watch; its files are
+                # logged NG and picked up again when they next change
+                print("watch upload failed: %s" % error)
+                rows = _resultRows(batch, ["NG"] * len(batch), transport.stats)
+            if callback is not None:
+                callback(rows)
+
+    sender = threading.Thread(target=send, name="watch-upload")
+    sender.daemon = True
+    sender.start()
+
+    # path -> ((size, mtime), time it was last seen changing)
+    pending = {}
+    # path -> ((size, mtime), time it was queued): repeated events and the
+    # overlap between scans must not queue a file twice. Entries are
+    # dropped once older than horizon, so this only covers recent activity
+    queued = {}
+    horizon = settle + config["watch_interval"] + 2
+    pruned = time.time()
+
+    def enqueue(path, signature):
+        queued[path] = (signature, time.time())
+        ready.put(path)
+
+    try:
+        while not stop.is_set():
+            for path in watcher.poll(min(settle / 2.0, 1.0) if pending else 1.0):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    pending.pop(path, None)
+                    continue
+                now = time.time()
+                if fileFilter is not None:
+                    fileFilter.setClock(now)
+                    if fileFilter.excludes(os.path.relpath(path, dirName).replace('\\', '/'), st.st_size,
+                                           st.st_mtime):
+                        continue
+                signature = (st.st_size, st.st_mtime)
+                if queued.get(path, (None,))[0] == signature:
+                    continue
+                if path not in pending and now - max(st.st_mtime, st.st_ctime) >= settle:
+                    enqueue(path, signature)
+                elif pending.get(path, (None,))[0] != signature:
+                    pending[path] = (signature, now)
+
+            for path, (signature, seen) in list(pending.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del pending[path]
+                    continue
+                now = time.time()
+                if (st.st_size, st.st_mtime) != signature:
+                    pending[path] = ((st.st_size, st.st_mtime), now)
+                elif now - seen >= settle:
+                    del pending[path]
+                    enqueue(path, signature)
+
+            if time.time() - pruned >= horizon:
+                pruned = time.time()
+                for path, (signature, at) in list(queued.items()):
+                    if pruned - at >= horizon:
+                        del queued[path]
+    finally:
+        stop.set()
+        sender.join()
+        watcher.close()
+
+def writeCSV(data, filename=None):
+    # a given filename is appended to (later rows of the same run, and watch
+    # mode's one file a day); without one a new file is made, with _2, _3, ...
+    # after the minute when an earlier run already has that name.
+    # UTF-8 with a BOM so Excel shows Japanese names; the BOM is only written
+    # at the start of a new file, and newline='' keeps csv's own line ends
+    if filename is None:
+        stem = 'GCP_Upload_' + str(dt.datetime.now().strftime('%Y%m%d%H%M'))
+        for n in itertools.count(1):
+            filename = stem + ('_%d' % n if n > 1 else '') + '.csv'
+            try:
+                csvfile = io.open(filename, 'x', encoding='utf-8-sig', newline='')
+                break
+            except FileExistsError:
+                pass
+    else:
+        csvfile = io.open(filename, 'a', encoding='utf-8-sig', newline='')
+    with csvfile:
+        csv.writer(csvfile).writerows(data)
+    return filename
+
+def _rowDict(row):
+    k, elem, result, bytesSaved, attempts = row
+    return {"no": k, "path": elem, "result": result, "bytes_saved": bytesSaved, "attempts": attempts}
+
+def main(argv=None):
+    # headless entry point for cron and servers without a display;
+    # options not given on the command line come from config.ini
+    import argparse
+    parser = argparse.ArgumentParser(description="upload a folder to GCP without the GUI")
+    parser.add_argument("source", help="folder to upload")
+    parser.add_argument("-d", "--destination", help="gs://bucket/prefix (or a folder for the local backend)")
+    parser.add_argument("-b", "--backend", choices=sorted(TRANSPORTS))
+    parser.add_argument("-w", "--workers", type=int, help="transfers running at the same time")
+    parser.add_argument("-c", "--config", default=CONFIG_FILE, help="config.ini to read [upload] from")
+    parser.add_argument("--json", action="store_true",
+                        help="one JSON object per file on stdout, then a summary object")
+    parser.add_argument("--no-csv", dest="csv", action="store_false", help="do not write GCP_Upload_*.csv")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and upload files as they appear (Ctrl+C to stop)")
+    parser.add_argument("--settle", type=float,
+                        help="seconds a file must stay unchanged before it is uploaded in watch mode")
+    parser.add_argument("--compact-index", action="store_true",
+                        help="after the run, drop scan index entries of folders it did not reach")
+    args = parser.parse_args(argv)
+
+    config = loadConfig(args.config)
+    for key in ("destination", "backend", "workers"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if args.settle is not None:
+        config["watch_settle"] = args.settle
+    if not config["destination"]:
+        parser.error("no destination: pass -d or set destination in %s" % args.config)
+    if args.compact_index and (args.watch or not config["scan_index"]):
+        parser.error("--compact-index needs scan_index = true in %s and no --watch" % args.config)
+
+    if not os.path.isdir(args.source):
+        parser.error("cannot read %s: not a folder" % args.source)
+
+    # the engine reports progress with print(); keep stdout machine readable
+    out = sys.stdout
+    log = sys.stderr if args.json else sys.stdout
+    csvName = []
+
+    def report(data):
+        # the rows of every finished batch, as they come
+        for row in data:
+            if args.json:
+                out.write(json.dumps(_rowDict(row), ensure_ascii=False) + "\n")
+            elif args.watch:
+                out.write("%s %s\n" % (row[2], row[1]))
+        out.flush()
+        if not args.csv or not data:
+            return
+        if args.watch:
+            writeCSV(data, 'GCP_Upload_watch_' + dt.datetime.now().strftime('%Y%m%d') + '.csv')
+        elif csvName:
+            writeCSV(data, csvName[0])
+        else:
+            csvName.append(writeCSV(data))
+
+    if args.watch:
+        # a daemon is stopped with SIGTERM; finish the batch in flight first
+        import signal
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        transport = getTransport(config)
+        try:
+            with contextlib.redirect_stdout(log):
+                watchFolder(args.source, config, transport, report, stop)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            transport.close()
+        return 0
+
+    transport = getTransport(config)
+    scanCounts = {}
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(log):
+            counts = uploadPipeline(args.source, config, transport, None, report, scanCounts)
+    finally:
+        transport.close()
+    elapsed = time.time() - start
+
+    if args.compact_index:
+        # everything the run reached was marked as seen after start
+        index = Scan_Index(os.path.join(config["state_dir"], "scan.db"))
+        try:
+            dropped = index.compact(_indexKey(args.source), start)
+        finally:
+            index.close()
+        log.write("scan index: %d stale folders dropped\n" % dropped)
+
+    files = sum(counts.values())
+    pruned = scanCounts.get("pruned", 0)
+    filename = csvName[0] if csvName else None
+    if args.json:
+        print(json.dumps({"files": files, "results": dict(counts), "pruned": pruned, "seconds": round(elapsed, 3),
+                          "destination": config["destination"], "csv": filename}, ensure_ascii=False))
+    else:
+        print("%d files in %.1fs: %s" % (files, elapsed,
+                                        ", ".join("%s %d" % item for item in sorted(counts.items()))))
+        if filename:
+            print("results written to %s" % filename)
+    return 1 if counts.get("NG") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())